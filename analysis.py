@@ -0,0 +1,110 @@
+import os
+import re
+import time
+import threading
+import Stemmer
+from metrics import metrics
+
+# Text analysis shared by index.py and search.py, so documents and queries are always
+# turned into terms the same way: tokenize, drop stopwords and noise, stem, strip punctuation,
+# drop tokens with digits.
+#
+# Tokens are memoized: stem_cache maps a token straight to its term, or to "" when the token
+# is a stopword or noise, so repeated tokens cost one dict lookup. The cache stops admitting
+# new tokens once it holds max_cache_entries; with a Zipfian vocabulary the frequent ones are
+# in by then.
+
+punctuation = ".,|+-@~`:;?()*\"'=\\&/<>[]{}#!%^$ "
+max_cache_entries = 1000000
+
+token_pattern = re.compile("[A-Z]{2,}(?![a-z])|[A-Z][a-z]+(?=[A-Z])|[\'\\w\\-]+")
+# On case folded text token_pattern reduces to this.
+word_pattern = re.compile(r"[\w'\-]+")
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stopwords.txt'), 'r') as f:
+    stopwords = frozenset(stopword.strip(' ').strip("\n") for stopword in f)
+
+stem_cache = {}
+# Token lookups served from / missed by stem_cache, tokens analyzed and seconds spent.
+analysis_stats = {"hits": 0, "misses": 0, "tokens": 0, "seconds": 0.0}
+
+# Stemmer objects are not thread safe, so every thread gets its own.
+stemmers = threading.local()
+
+
+def tokenize(content):
+    return token_pattern.findall(content)
+
+
+def stemWords(content):
+    if not hasattr(stemmers, 'stemmer'):
+        stemmers.stemmer = Stemmer.Stemmer('english')
+    return stemmers.stemmer.stemWords(content)
+
+
+def is_noise(content):
+    return content in punctuation or len(content) <= 1 or len(content) >= 30
+
+
+def removeNoise(content):
+    return [word for word in content if word not in stopwords and not is_noise(word)]
+
+
+# Term of a stemmed token: apostrophes, hyphens and underscores around it are stripped, and
+# tokens with digits are not indexed ("").
+def make_term(stem):
+    if any(c.isdigit() for c in stem):
+        return ""
+    return stem.strip("'-").strip("-_")
+
+
+# Tokenizing, removing stopwords, stemming (without the cache; used by the legacy segmenter).
+def NLProcessing(content):
+    return [term for term in map(make_term, stemWords(removeNoise(tokenize(content)))) if term]
+
+
+# Terms of a list of tokens.
+def analyze_tokens(tokens):
+    start = time.perf_counter()
+    cache = stem_cache
+    # Every occurrence of a token not in the cache is a miss, repeats within the call included.
+    missing = [token for token in tokens if token not in cache]
+    num_misses = len(missing)
+    new_terms = {}
+    if missing:
+        missing = list(set(missing))
+        kept = removeNoise(missing)
+        for token in missing:
+            new_terms[token] = ""
+        for token, stem in zip(kept, stemWords(kept)):
+            new_terms[token] = make_term(stem)
+        if len(cache) + len(new_terms) <= max_cache_entries:
+            cache.update(new_terms)
+    cache_get = cache.get
+    terms = []
+    for token in tokens:
+        term = cache_get(token)
+        if term is None:
+            term = new_terms[token]
+        if term:
+            terms.append(term)
+    analysis_stats["hits"] += len(tokens) - num_misses
+    analysis_stats["misses"] += num_misses
+    analysis_stats["tokens"] += len(tokens)
+    seconds = time.perf_counter() - start
+    analysis_stats["seconds"] += seconds
+    metrics.add_time("analysis.stem", seconds)
+    return terms
+
+
+# Terms of case folded text.
+def analyze(content):
+    start = time.perf_counter()
+    tokens = word_pattern.findall(content)
+    metrics.add_time("analysis.tokenize", time.perf_counter() - start)
+    return analyze_tokens(tokens)
+
+
+def add_analysis_stats(stats):
+    for key in analysis_stats:
+        analysis_stats[key] += stats[key]
@@ -0,0 +1,43 @@
+import os
+
+# Atomic file writes: a file is written under a temporary name (<path>.tmp), synced and renamed,
+# so readers and a crashed process only ever see the previous file or the complete new one.
+
+
+class AtomicFile(object):
+    def __init__(self, path, mode='wb', buffer_size=-1):
+        self.path = path
+        self.f = open(path + '.tmp', mode, buffering=buffer_size)
+
+    def write(self, data):
+        return self.f.write(data)
+
+    def tell(self):
+        return self.f.tell()
+
+    # Syncs the temporary file and renames it to path.
+    def close(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    # Drops the temporary file; the file at path is left as it was.
+    def discard(self):
+        self.f.close()
+        os.remove(self.path + '.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+# Replaces the file at path with content, a str.
+def write_atomic(path, content):
+    with AtomicFile(path, 'w') as f:
+        f.write(content)
@@ -0,0 +1,71 @@
+# Compares per-query latency of the scoring loop, MaxScore, the numpy scoring path and, on an
+# index built with --impacts, score-at-a-time over quantized impacts (whose top 10 can differ).
+# Queries are built from random dictionary terms; the posting list cache is disabled so every
+# query also decodes its postings. Run from the repository root:
+#     python3 benchmarks/bench_scoring.py <path_to_inverted_index> [num_queries]
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import search
+
+rankings = ["exhaustive", "maxscore", "numpy", "impact"]
+
+
+# Simple queries of 1-4 terms (each expanded to six fields) and field queries of 2-4 terms,
+# each in a field it occurs in.
+def make_queries(index_dir, num_queries):
+    keys = []
+    with open(index_dir + '/dictionary.txt', 'r') as f:
+        for line in f:
+            values = line.split()
+            for i in range(len(search.field_acronyms)):
+                if values[4 + i] != "0":
+                    keys.append((values[0], search.field_acronyms[i]))
+    random.seed(42)
+    simple = []
+    field = []
+    for i in range(num_queries):
+        terms = [random.choice(keys)[0] for _ in range(random.randint(1, 4))]
+        simple.append(" ".join(terms))
+        keys_sample = [random.choice(keys) for _ in range(random.randint(2, 4))]
+        field.append(" ".join(fld + ":" + term for term, fld in keys_sample))
+    return simple, field
+
+
+def time_queries(queries):
+    times = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search.search(query))
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times, results
+
+
+if __name__ == "__main__":
+    index_dir = sys.argv[1]
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    search.load_index(index_dir)
+    search.posting_cache = search.LRUCache(0)
+    simple, field = make_queries(index_dir, num_queries)
+    for name, queries in [("simple", simple), ("field", field)]:
+        baseline = None
+        for ranking in rankings:
+            if ranking == "numpy" and search.np is None:
+                print("numpy is not installed, skipping the numpy ranking")
+                continue
+            if ranking == "impact" and not search.has_impacts():
+                continue
+            search.ranking = ranking
+            times, results = time_queries(queries)
+            if baseline is None:
+                baseline = results
+            overlap = sum(len(set(a) & set(b)) for a, b in zip(results, baseline)) / max(
+                sum(len(b) for b in baseline), 1)
+            print("%-6s %-10s mean %7.2f ms  p50 %7.2f ms  p95 %7.2f ms  same top 10: %s  overlap %.3f" % (
+                name, ranking, 1000 * sum(times) / len(times), 1000 * times[len(times) // 2],
+                1000 * times[int(len(times) * 0.95)], results == baseline, overlap))
@@ -0,0 +1,51 @@
+# Compares pages/sec of the single scan segmenter against the legacy WikiDoc segmenter.
+# Run from the repository root (index.py reads stopwords.txt from there):
+#     python3 benchmarks/bench_segmenter.py <path_to_wiki_dump> [num_pages]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from index import WikiDoc
+from dumps import open_dump, read_pages
+
+field_names = ['title_words', 'body_words', 'infobox_words',
+               'category_words', 'link_words', 'reference_words']
+
+
+# (doc_id, title, text) of the first max_pages pages.
+def load_pages(dump_path, max_pages, reader="auto", workers=1):
+    pages = []
+    with open_dump(dump_path, reader, workers) as dump:
+        for page in read_pages(dump):
+            if len(pages) >= max_pages:
+                break
+            pages.append(page)
+    return pages
+
+
+def time_segmenter(pages, legacy):
+    docs = []
+    start = time.perf_counter()
+    for doc_num, (doc_id, title, text) in enumerate(pages):
+        docs.append(WikiDoc(doc_num, doc_id, title, text, legacy))
+    return time.perf_counter() - start, docs
+
+
+if __name__ == "__main__":
+    dump_path = sys.argv[1]
+    num_pages = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    pages = load_pages(dump_path, num_pages)
+    legacy_time, legacy_docs = time_segmenter(pages, True)
+    scan_time, scan_docs = time_segmenter(pages, False)
+    print("pages:", len(pages))
+    print("legacy WikiDoc: %.1f pages/sec" % (len(pages) / legacy_time))
+    print("single scan:    %.1f pages/sec" % (len(pages) / scan_time))
+    print("speedup:        %.2fx" % (legacy_time / scan_time))
+    # The legacy code mixes slice-relative and absolute offsets for the category,
+    # reference and link sections, only strips the first two section markers and
+    # only finds external links placed before the references, so those fields
+    # (and the body they are cut from) can legitimately differ.
+    for field in field_names:
+        same = sum(1 for a, b in zip(legacy_docs, scan_docs) if getattr(a, field) == getattr(b, field))
+        print("%-16s identical in %d/%d pages" % (field, same, len(pages)))
@@ -0,0 +1,219 @@
+# Reproducible indexing and query benchmark. Generates a synthetic dump (gen_dump.py) unless
+# one is given, then times each indexing stage separately and the latency of simple and field
+# queries against the resulting index. Results are written as JSON; with --baseline the
+# relative change of every metric against an earlier result file is printed. Run from the
+# repository root:
+#     python3 benchmarks/bench_suite.py [--pages N] [--dump <dump.xml.bz2>] [--output results.json]
+#                                       [--baseline old_results.json]
+#
+# Stages: parse (reading and parsing the dump with --reader, see dumps.py), process (WikiDoc field segmentation and analysis),
+# spill (building the in-memory index and writing sorted runs of --pages-per-run pages),
+# merge (k-way merge of the runs into one) and split (writing the split posting files, the
+# dictionary and the secondary index), and with --impacts, impacts (the quantized impact lists).
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import index
+import search
+from titles import TitleStoreWriter
+from metrics import metrics
+from dumps import readers
+from gen_dump import write_dump
+from bench_segmenter import load_pages
+from bench_scoring import make_queries
+
+
+# Nearest-rank percentile of sorted values.
+def percentile(values, p):
+    return values[min(len(values) - 1, max(int(math.ceil(p / 100.0 * len(values))) - 1, 0))]
+
+
+def stage(seconds, num_pages):
+    return {"seconds": round(seconds, 4), "pages_per_sec": round(num_pages / max(seconds, 1e-9), 1)}
+
+
+def dir_size(path):
+    size = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(dir_path, file_name))
+    return size
+
+
+def bench_indexing(dump_path, out_path, pages_per_run, buffer_size, impact_bits=0, reader="auto", reader_workers=1):
+    index.inv_index_out_path = out_path
+    index.inv_index_stat_path = out_path
+    for dir_name in ["intermediates", "indexes"]:
+        os.makedirs(os.path.join(out_path, dir_name), exist_ok=True)
+    results = {}
+
+    start = time.perf_counter()
+    pages = load_pages(dump_path, float('inf'), reader, reader_workers)
+    num_pages = len(pages)
+    results["parse"] = stage(time.perf_counter() - start, num_pages)
+
+    start = time.perf_counter()
+    docs = [index.WikiDoc(doc_num, doc_id, title, text) for doc_num, (doc_id, title, text) in enumerate(pages)]
+    results["process"] = stage(time.perf_counter() - start, num_pages)
+
+    start = time.perf_counter()
+    title_store = TitleStoreWriter(out_path + '/titles.bin')
+    run_paths = []
+    run_index = index.MemoryIndex()
+    for doc in docs:
+        title_store.add(doc.doc_id, doc.title.lower())
+        index.addDocToIndex(run_index, doc)
+        if (doc.doc_num + 1) % pages_per_run == 0 or doc.doc_num + 1 == num_pages:
+            run_paths.append(index.writeIntermediateIndex(run_index, out_path, len(run_paths) + 1))
+            run_index.clear()
+    title_store.close()
+    results["spill"] = stage(time.perf_counter() - start, num_pages)
+    results["spill"]["runs"] = len(run_paths)
+
+    start = time.perf_counter()
+    merged_path = index.mergeIntermediate(run_paths, len(run_paths) + 1, buffer_size)
+    for run_path in run_paths:
+        os.remove(run_path)
+    results["merge"] = stage(time.perf_counter() - start, num_pages)
+
+    start = time.perf_counter()
+    index.writeFinalIndex(index.runRecords(merged_path, buffer_size), out_path, buffer_size)
+    os.remove(merged_path)
+    results["split"] = stage(time.perf_counter() - start, num_pages)
+
+    stages = ["parse", "process", "spill", "merge", "split"]
+    if impact_bits:
+        start = time.perf_counter()
+        index.writeImpactIndex(out_path, num_pages, impact_bits, buffer_size)
+        results["impacts"] = stage(time.perf_counter() - start, num_pages)
+        stages.append("impacts")
+    index.curr_doc_count = num_pages
+    index.writeIndexStatFile()
+    total = sum(results[name]["seconds"] for name in stages)
+    results["total"] = stage(total, num_pages)
+    results["num_pages"] = num_pages
+    results["index_bytes"] = {
+        "postings": dir_size(out_path + '/indexes'),
+        "dictionary": os.path.getsize(out_path + '/dictionary.txt'),
+        "secondary_index": os.path.getsize(out_path + '/secondary_index.txt'),
+        "titles": os.path.getsize(out_path + '/titles.bin')}
+    if impact_bits:
+        results["index_bytes"]["impacts"] = dir_size(out_path + '/impacts')
+    results["dump_bytes"] = os.path.getsize(dump_path)
+    results["num_index_files"] = index.num_index_files
+    results["num_terms"] = index.num_index_tokens
+    return results
+
+
+def bench_queries(index_path, num_queries, ranking):
+    # Decode every query's postings.
+    search.ranking = ranking
+    search.posting_cache = search.LRUCache(0)
+    search.load_index(index_path)
+    results = {}
+    for name, queries in zip(["simple", "field"], make_queries(index_path, num_queries)):
+        times = []
+        for query in queries:
+            start = time.perf_counter()
+            search.search(query)
+            times.append(1000 * (time.perf_counter() - start))
+        times.sort()
+        results[name] = {"queries": len(times), "mean_ms": round(sum(times) / len(times), 3),
+                         "p50_ms": round(percentile(times, 50), 3), "p95_ms": round(percentile(times, 95), 3),
+                         "p99_ms": round(percentile(times, 99), 3), "max_ms": round(times[-1], 3)}
+    return results
+
+
+# Flattened "a.b.c" -> value of the numeric leaves of a result dict.
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if key == "config":
+            continue
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline):
+    for key, value in results["config"].items():
+        if key != "time" and baseline.get("config", {}).get(key) != value:
+            print("Note: baseline has", key, "=", baseline.get("config", {}).get(key), "here", value)
+    old = flatten(baseline)
+    for key, value in sorted(flatten(results).items()):
+        if key in old and old[key]:
+            print("%-40s %14s -> %-14s %+7.1f%%" % (key, old[key], value, 100.0 * (value - old[key]) / old[key]))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--dump", help="benchmark this dump instead of a synthetic one")
+    arg_parser.add_argument("--pages", type=int, default=5000, help="pages of the synthetic dump")
+    arg_parser.add_argument("--words", type=int, default=300, help="mean words per synthetic page")
+    arg_parser.add_argument("--seed", type=int, default=1)
+    arg_parser.add_argument("--pages-per-run", type=int, default=1000, help="pages per spilled run")
+    arg_parser.add_argument("--merge-buffer-kb", type=int, default=1024)
+    arg_parser.add_argument("--queries", type=int, default=500, help="queries of each kind")
+    arg_parser.add_argument("--ranking", choices=["maxscore", "numpy", "exhaustive", "impact"], default="maxscore")
+    arg_parser.add_argument("--impacts", action="store_true", help="also build the impact lists (index.py --impacts)")
+    arg_parser.add_argument("--reader", choices=readers, default="auto",
+                            help="dump reader (dumps.py); the synthetic dump is written as a multistream "
+                                 "dump for the multistream reader")
+    arg_parser.add_argument("--reader-workers", type=int, default=1)
+    arg_parser.add_argument("--work-dir", help="keep the dump and the index here instead of a temporary directory")
+    arg_parser.add_argument("--output", default="bench_results.json")
+    arg_parser.add_argument("--baseline", help="earlier result file to compare against")
+    args = arg_parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="wiki_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    dump_path = args.dump
+    start = time.perf_counter()
+    if dump_path is None:
+        dump_path = os.path.join(work_dir, 'dump.xml.bz2')
+        write_dump(dump_path, args.pages, args.words, args.seed,
+                   pages_per_stream=100 if args.reader == "multistream" else 0)
+    generate_time = time.perf_counter() - start
+    index_path = os.path.join(work_dir, 'index')
+    os.makedirs(index_path, exist_ok=True)
+
+    results = {"config": {"dump": args.dump or "synthetic", "pages": args.pages, "words": args.words,
+                          "seed": args.seed, "pages_per_run": args.pages_per_run, "queries": args.queries,
+                          "impacts": args.impacts, "reader": args.reader, "reader_workers": args.reader_workers,
+                          "ranking": args.ranking, "python": platform.python_version(),
+                          "machine": platform.machine(), "time": time.strftime("%Y-%m-%d %H:%M:%S")},
+               "generate_seconds": round(generate_time, 4)}
+    if args.ranking == "impact" and not args.impacts:
+        arg_parser.error("--ranking impact needs --impacts")
+    results["indexing"] = bench_indexing(dump_path, index_path, args.pages_per_run, args.merge_buffer_kb * 1024,
+                                         8 if args.impacts else 0, args.reader, args.reader_workers)
+    results["queries"] = bench_queries(index_path, args.queries, args.ranking)
+    # Time per stage, summed over the whole run (metrics.py).
+    results["metrics"] = metrics.snapshot()
+    if args.work_dir is None:
+        shutil.rmtree(work_dir)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    for name in ["parse", "process", "spill", "merge", "split", "impacts", "total"]:
+        if name not in results["indexing"]:
+            continue
+        print("%-8s %9.1f pages/sec  %8.3f s" % (name, results["indexing"][name]["pages_per_sec"],
+                                                  results["indexing"][name]["seconds"]))
+    print("index    %9.2f MB" % (sum(results["indexing"]["index_bytes"].values()) / 1024 / 1024))
+    for name, stats in results["queries"].items():
+        print("%-8s p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms" % (name, stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]))
+    print("Results written to", args.output)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            compare(results, json.load(f))
@@ -0,0 +1,135 @@
+# Writes a synthetic, bz2 compressed MediaWiki XML dump for benchmarks. Words follow a Zipf
+# distribution over a fixed synthetic vocabulary (headed by common English function words),
+# and pages carry infoboxes, sections, citations, references, external links and categories
+# in the markup the segmenter looks for. The same seed always gives the same dump:
+#     python3 benchmarks/gen_dump.py <out.xml.bz2> [--pages N] [--words N] [--seed N] [--multistream N]
+# With --multistream the dump is written like a pages-articles-multistream dump: one bz2 stream
+# per N pages (plus a header and a footer stream), and an index file out-index.txt.bz2 with
+# the offset of each page's stream.
+import bz2
+import random
+import argparse
+from xml.sax.saxutils import escape, unescape
+
+syllables = ["ka", "ri", "to", "men", "sa", "lo", "pre", "dun", "vi", "ox", "tel", "ar", "bon",
+             "cha", "phi", "gra", "stu", "ion", "ers", "ing", "mo", "del", "tur", "qua", "nel"]
+function_words = ["the", "of", "and", "in", "to", "was", "is", "for", "on", "as", "by", "with",
+                  "he", "at", "from", "his", "an", "were", "are", "which", "it", "also", "this"]
+infobox_fields = ["name", "type", "location", "country", "born", "founded", "genre", "population",
+                  "area", "occupation", "years_active", "website"]
+section_names = ["History", "Early life", "Career", "Geography", "Economy", "Reception", "Legacy"]
+
+
+# Random words drawn from a Zipf distribution over the vocabulary.
+class WordSource(object):
+    def __init__(self, rng, vocab_size, exponent=1.07):
+        self.rng = rng
+        vocab = set()
+        while len(vocab) < vocab_size:
+            vocab.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+        # Sorted first: set order changes between runs.
+        vocab = sorted(vocab)
+        rng.shuffle(vocab)
+        self.vocab = function_words + vocab
+        self.cum_weights = []
+        total = 0.0
+        for rank in range(1, len(self.vocab) + 1):
+            total += 1.0 / rank ** exponent
+            self.cum_weights.append(total)
+
+    def words(self, n):
+        return self.rng.choices(self.vocab, cum_weights=self.cum_weights, k=n)
+
+    def text(self, n):
+        return " ".join(self.words(n))
+
+    def title(self, n):
+        return " ".join(word.capitalize() for word in self.words(n))
+
+
+def make_page(rng, source, doc_id, num_words):
+    parts = []
+    if rng.random() < 0.6:
+        parts.append("{{Infobox " + source.text(1))
+        for field in rng.sample(infobox_fields, rng.randint(3, 8)):
+            parts.append("| " + field + " = " + source.title(rng.randint(1, 4)))
+        parts.append("}}")
+    lead = max(num_words // 4, 1)
+    parts.append("'''" + source.title(2) + "''' " + source.text(lead) + " [[" + source.title(2) + "]]")
+    num_sections = rng.randint(1, 4)
+    for section in rng.sample(section_names, num_sections):
+        parts.append("== " + section + " ==")
+        parts.append(source.text((num_words - lead) // num_sections) +
+                     "<ref>{{cite web |url=http://www." + source.text(1) + ".org/" + str(doc_id) +
+                     " |title=" + source.title(3) + "}}</ref> [[" + source.title(2) + "|" + source.text(1) + "]]")
+    if rng.random() < 0.7:
+        parts.append("== References ==")
+        parts.append("{{reflist}}")
+        for _ in range(rng.randint(1, 5)):
+            parts.append("* " + source.title(3) + ". ''" + source.title(2) + "''. " + str(rng.randint(1900, 2020)) + ".")
+    if rng.random() < 0.5:
+        parts.append("== External links ==")
+        for _ in range(rng.randint(1, 4)):
+            parts.append("* [http://www." + source.text(1) + ".com/" + source.text(1) + " " + source.title(3) + "]")
+    for _ in range(rng.randint(1, 5)):
+        parts.append("[[Category:" + source.title(rng.randint(1, 3)) + "]]")
+    text = "\n".join(parts)
+    return ("  <page>\n    <title>" + escape(source.title(rng.randint(1, 4))) + "</title>\n    <ns>0</ns>\n" +
+            "    <id>" + str(doc_id) + "</id>\n    <revision>\n      <id>" + str(doc_id * 10 + 1) + "</id>\n" +
+            "      <text xml:space=\"preserve\">" + escape(text) + "</text>\n    </revision>\n  </page>\n")
+
+
+def write_dump(path, num_pages, num_words=300, seed=1, vocab_size=50000, pages_per_stream=0):
+    rng = random.Random(seed)
+    source = WordSource(rng, vocab_size)
+    pages = (make_page(rng, source, 10 + 3 * i, max(int(rng.gauss(num_words, num_words / 3)), 10))
+             for i in range(num_pages))
+    if pages_per_stream > 0:
+        write_multistream(path, pages, pages_per_stream)
+        return
+    with bz2.open(path, 'wt', encoding='utf-8') as f:
+        f.write("<mediawiki xml:lang=\"en\">\n")
+        for page in pages:
+            f.write(page)
+        f.write("</mediawiki>\n")
+
+
+def write_multistream(path, pages, pages_per_stream):
+    index_lines = []
+    with open(path, 'wb') as f:
+        f.write(bz2.compress("<mediawiki xml:lang=\"en\">\n".encode('utf-8')))
+        stream = []
+        for page in pages:
+            stream.append(page)
+            if len(stream) == pages_per_stream:
+                write_stream(f, stream, index_lines)
+                stream = []
+        if stream:
+            write_stream(f, stream, index_lines)
+        f.write(bz2.compress("</mediawiki>\n".encode('utf-8')))
+    with bz2.open(path[:-len('.xml.bz2')] + '-index.txt.bz2', 'wt', encoding='utf-8') as f:
+        f.writelines(index_lines)
+
+
+def write_stream(f, stream, index_lines):
+    offset = f.tell()
+    for page in stream:
+        title = unescape(page[page.index("<title>") + len("<title>"): page.index("</title>")])
+        doc_id = page[page.index("<id>") + len("<id>"): page.index("</id>")]
+        index_lines.append(str(offset) + ":" + doc_id + ":" + title + "\n")
+    f.write(bz2.compress("".join(stream).encode('utf-8')))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("out_path")
+    arg_parser.add_argument("--pages", type=int, default=5000)
+    arg_parser.add_argument("--words", type=int, default=300, help="mean number of words of running text per page")
+    arg_parser.add_argument("--vocab", type=int, default=50000, help="number of distinct synthetic words")
+    arg_parser.add_argument("--seed", type=int, default=1)
+    arg_parser.add_argument("--multistream", type=int, default=0, metavar="N",
+                            help="write a multistream dump with N pages per stream, and its index")
+    args = arg_parser.parse_args()
+    if args.multistream > 0 and not args.out_path.endswith('.xml.bz2'):
+        arg_parser.error("a multistream dump must be named *.xml.bz2")
+    write_dump(args.out_path, args.pages, args.words, args.seed, args.vocab, args.multistream)
@@ -0,0 +1,118 @@
+import math
+import struct
+import hashlib
+from array import array
+from atomic import AtomicFile
+
+# Bloom filter over the "term-field" keys of an index directory (vocabulary.bloom), so search
+# can answer "not indexed" for most absent keys without reading the dictionary. A key is set
+# in num_hashes bits, at (h1 + i * h2) mod num_bits. The term is hashed once with blake2b for
+# all of its fields: h2 and h1 are the two 64 bit halves of the hash, h1 xored with a constant
+# of the field. File layout:
+#     <bits: num_bits / 8 bytes><footer: num_bits uint64, num_keys uint64, num_hashes uint32, magic>
+# The number of bits and hashes follow from the number of keys and the target false positive
+# rate: num_bits = -n ln(p) / ln(2)^2, num_hashes = num_bits / n * ln(2).
+
+footer = struct.Struct('<QQI4s')
+magic = b'WBF1'
+
+
+# Mixed into h1 for each field slot.
+field_mix = [(slot + 1) * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF for slot in range(64)]
+
+
+# Two 64 bit hashes of a term; h2 is odd, so the probes of a key are distinct.
+def term_hashes(term):
+    digest = hashlib.blake2b(term.encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+# (num_bits, num_hashes) of a filter of num_keys keys with false positive rate fp_rate.
+def filter_size(num_keys, fp_rate):
+    num_bits = max(int(math.ceil(-max(num_keys, 1) * math.log(fp_rate) / math.log(2) ** 2)), 64)
+    num_bits = (num_bits + 7) // 8 * 8
+    num_hashes = max(int(round(num_bits / max(num_keys, 1) * math.log(2))), 1)
+    return num_bits, num_hashes
+
+
+class BloomFilter(object):
+    def __init__(self, num_bits, num_hashes, bits=None, num_keys=0):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray(num_bits // 8)
+        self.num_keys = num_keys
+
+    def add_hashes(self, h1, h2):
+        for i in range(self.num_hashes):
+            pos = (h1 + i * h2) % self.num_bits
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.num_keys += 1
+
+    def contains_hashes(self, h1, h2):
+        bits = self.bits
+        for i in range(self.num_hashes):
+            pos = (h1 + i * h2) % self.num_bits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    # True if the key of the term and any of the field slots may be in the filter.
+    def may_contain(self, term, slots):
+        h1, h2 = term_hashes(term)
+        for slot in slots:
+            if self.contains_hashes(h1 ^ field_mix[slot], h2):
+                return True
+        return False
+
+    # Expected false positive rate for the keys added.
+    def fp_rate(self):
+        return (1 - math.exp(-self.num_hashes * self.num_keys / self.num_bits)) ** self.num_hashes
+
+    def size(self):
+        return len(self.bits) + footer.size
+
+    # Written atomically, so a crash never leaves a truncated filter that misses keys.
+    def write(self, path):
+        with AtomicFile(path) as f:
+            f.write(self.bits)
+            f.write(footer.pack(self.num_bits, self.num_keys, self.num_hashes, magic))
+
+
+# Collects the hashes of the keys of an index being written, then sizes the filter for them.
+class BloomFilterWriter(object):
+    def __init__(self, path, fp_rate):
+        self.path = path
+        self.fp_rate = fp_rate
+        self.hashes = array('Q')
+
+    # Adds the keys of the term and the field slots.
+    def add(self, term, slots):
+        h1, h2 = term_hashes(term)
+        for slot in slots:
+            self.hashes.append(h1 ^ field_mix[slot])
+            self.hashes.append(h2)
+
+    # Writes the filter and returns it.
+    def close(self):
+        num_keys = len(self.hashes) // 2
+        bloom_filter = BloomFilter(*filter_size(num_keys, self.fp_rate))
+        for i in range(num_keys):
+            bloom_filter.add_hashes(self.hashes[2 * i], self.hashes[2 * i + 1])
+        bloom_filter.write(self.path)
+        self.hashes = array('Q')
+        return bloom_filter
+
+
+# The filter of path, None if the index has none.
+def read_filter(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < footer.size:
+        raise ValueError(path + " is not a Bloom filter")
+    num_bits, num_keys, num_hashes, file_magic = footer.unpack(data[-footer.size:])
+    if file_magic != magic or len(data) - footer.size != num_bits // 8:
+        raise ValueError(path + " is not a Bloom filter")
+    return BloomFilter(num_bits, num_hashes, data[:-footer.size], num_keys)
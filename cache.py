@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from atomic import write_atomic
+
+# LRU cache bounded by the total size of its values in bytes rather than by entry count.
+# With frequency=True a key is only admitted the second time it is put within a window of
+# recent keys, so terms that are looked up once do not push out the popular ones.
+#
+# ResultCache keeps the final results of queries for one build of the index: at most
+# max_entries, least recently used first out, each for ttl seconds (0 keeps them until evicted).
+# Setting a different build id empties it. With a path it can be saved to and loaded from a
+# JSON file, so it survives restarts; entries of another build or past their ttl are not loaded.
+
+
+class LRUCache(object):
+    def __init__(self, max_bytes, frequency=False, window=100000):
+        self.max_bytes = max_bytes
+        self.frequency = frequency
+        self.window = window
+        self.seen = set()
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if size > self.max_bytes:
+                return
+            if self.frequency and key not in self.seen:
+                if len(self.seen) >= self.window:
+                    self.seen.clear()
+                self.seen.add(key)
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.num_bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.num_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.seen.clear()
+            self.num_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "bytes": self.num_bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+class ResultCache(object):
+    def __init__(self, max_entries, ttl=0, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.build_id = None
+        # key -> (results, expiry time, 0 for none)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # Whether there are entries not saved yet.
+        self.changed = False
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] and entry[1] < time.time():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, results):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (results, time.time() + self.ttl if self.ttl else 0)
+            self.changed = True
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # Empties the cache if build_id is not the build its results are of.
+    def set_build_id(self, build_id):
+        with self.lock:
+            if build_id != self.build_id:
+                self.entries.clear()
+                self.build_id = build_id
+                self.changed = True
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            saved = json.load(f)
+        now = time.time()
+        with self.lock:
+            self.entries.clear()
+            self.build_id = saved["build_id"]
+            for key, results, expires in saved["entries"][-self.max_entries:] if self.max_entries > 0 else []:
+                if not expires or expires >= now:
+                    self.entries[key] = ([tuple(result) for result in results], expires)
+
+    # Written atomically, so a crash leaves the previous file.
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+        with self.lock:
+            self.changed = False
+            saved = {"build_id": self.build_id,
+                     "entries": [[key, results, expires] for key, (results, expires) in self.entries.items()]}
+        write_atomic(self.path, json.dumps(saved))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "expirations": self.expirations, "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
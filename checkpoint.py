@@ -0,0 +1,63 @@
+import os
+import json
+import logging
+from atomic import write_atomic
+
+# Checkpoint of an index build (index.py), so a build that crashed or was killed can go on with
+# --resume instead of starting again from the first page. checkpoint.json, in the index root:
+#
+#     dump        path, size and modification time of the dump being indexed
+#     segment     name and first doc number of the segment being built, or null
+#     phase       "index" while pages are indexed, "merge" while the runs are merged, "merged"
+#                 once the final index is written
+#     pages       pages of the dump indexed into the runs and written to the title store; a
+#                 resumed build parses them again without indexing them, since a compressed dump
+#                 cannot be entered at an arbitrary byte offset
+#     runs        complete intermediate runs, in doc number order, and the last file number used
+#     stats       token and analysis counts of the indexed pages, and the final index counts
+#                 once merged
+#
+# Every file a checkpoint refers to is complete when the checkpoint is written: runs are
+# written to a temporary file, synced and renamed, and the title store is synced first (its
+# offsets go to titles.bin.offsets until the store is closed). The checkpoint itself is
+# replaced atomically. Files of the intermediates directory that the checkpoint does not list
+# are leftovers of the interrupted build and are removed on resume.
+
+log = logging.getLogger("checkpoint")
+
+
+def checkpoint_path(root):
+    return os.path.join(root, 'checkpoint.json')
+
+
+# Identifies the dump a checkpoint was taken on.
+def dump_identity(path):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+# The checkpoint of root, None if there is none.
+def read_checkpoint(root):
+    try:
+        with open(checkpoint_path(root), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(root, state):
+    write_atomic(checkpoint_path(root), json.dumps(state, indent=1))
+
+
+def remove_checkpoint(root):
+    if os.path.exists(checkpoint_path(root)):
+        os.remove(checkpoint_path(root))
+
+
+# Removes the files of the intermediates directory except the runs in keep.
+def clean_intermediates(path, keep=()):
+    keep = set(keep)
+    for file_name in os.listdir(path):
+        if file_name not in keep:
+            log.info("Removing %s of an interrupted build", file_name)
+            os.remove(os.path.join(path, file_name))
@@ -0,0 +1,244 @@
+import re
+import os
+import bz2
+import mmap
+import time
+import logging
+import argparse
+import multiprocessing
+from collections import deque
+from xml.parsers import expat
+
+# Reading Wikipedia dumps: opening the dump as a stream of XML bytes, and streaming its pages.
+#
+# Readers:
+#     plain        uncompressed XML
+#     bz2          the C bz2 module of the standard library, on the calling process
+#     bz2file      the pure Python bz2file package (the indexer's original reader)
+#     multistream  multistream bz2 dumps (pages-articles-multistream), whose streams are
+#                  decompressed in parallel on worker processes and handed back in order
+#     auto         plain or bz2 by file name, multistream for bz2 with more than one worker
+#
+# A multistream dump is a concatenation of bz2 streams of about 100 pages each; its index
+# file (...-multistream-index.txt.bz2, lines "offset:page id:title") gives the byte offset of
+# every stream. Without the index file the stream headers are found by scanning the dump.
+#
+# read_pages parses with expat, keeping the character data of a page as a list of buffered
+# chunks joined once at the end of the page, and yields (page id, title, text).
+
+log = logging.getLogger("dumps")
+readers = ["auto", "plain", "bz2", "bz2file", "multistream"]
+# Header of a bz2 stream and of its first block: "BZh", block size, then the block magic.
+stream_header = re.compile(rb"BZh[1-9]1AY&SY")
+
+
+# Default multistream index of a dump, next to it.
+def default_index_path(path):
+    if path.endswith('.xml.bz2'):
+        index_path = path[:-len('.xml.bz2')] + '-index.txt.bz2'
+        if os.path.exists(index_path):
+            return index_path
+    return None
+
+
+# Sorted byte offsets of the bz2 streams of a dump, from its index file if given.
+def stream_offsets(path, index_path=None):
+    offsets = {0}
+    if index_path is not None:
+        with bz2.open(index_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                offsets.add(int(line[:line.index(':')]))
+        return sorted(offsets)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for match in stream_header.finditer(data):
+                offsets.add(match.start())
+    return sorted(offsets)
+
+
+# (start, end) byte ranges of whole streams, each at least chunk_size bytes except the last.
+def chunk_ranges(offsets, file_size, chunk_size):
+    ranges = []
+    start = 0
+    for offset in offsets[1:] + [file_size]:
+        if offset - start >= chunk_size or offset == file_size:
+            if offset > start:
+                ranges.append((start, offset))
+            start = offset
+    return ranges
+
+
+# Worker side of the multistream reader: the decompressed streams in path[start:end].
+def decompress_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    out = []
+    while data:
+        decompressor = bz2.BZ2Decompressor()
+        out.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise ValueError("bz2 stream at byte %d of %s is cut at byte %d" % (start, path, end))
+        data = decompressor.unused_data
+    return b"".join(out)
+
+
+# File-like reader of a multistream bz2 dump. Ranges of streams are decompressed on a process
+# pool, at most max_pending at a time, and read back in order.
+class MultistreamReader(object):
+    def __init__(self, path, workers=2, index_path=None, chunk_size=4 << 20):
+        self.path = path
+        offsets = stream_offsets(path, index_path)
+        self.ranges = chunk_ranges(offsets, os.path.getsize(path), chunk_size)
+        if len(offsets) < 2:
+            log.warning("%s has a single bz2 stream; it is decompressed on one process", path)
+        self.pool = multiprocessing.Pool(workers)
+        self.max_pending = 2 * workers
+        self.pending = deque()
+        self.next_range = 0
+        self.buffer = b""
+        self.pos = 0
+
+    def submit(self):
+        while len(self.pending) < self.max_pending and self.next_range < len(self.ranges):
+            start, end = self.ranges[self.next_range]
+            self.pending.append(self.pool.apply_async(decompress_range, (self.path, start, end)))
+            self.next_range += 1
+
+    # Returns at most size bytes, b"" at the end of the dump.
+    def read(self, size=-1):
+        if size < 0:
+            parts = []
+            data = self.read(1 << 20)
+            while data:
+                parts.append(data)
+                data = self.read(1 << 20)
+            return b"".join(parts)
+        while self.pos >= len(self.buffer):
+            self.submit()
+            if len(self.pending) == 0:
+                return b""
+            self.buffer = self.pending.popleft().get()
+            self.pos = 0
+            self.submit()
+        data = self.buffer[self.pos: self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Opens a dump for reading its XML as bytes with one of the readers above.
+def open_dump(path, reader="auto", workers=1, index_path=None):
+    if reader == "auto":
+        if not path.endswith('.bz2'):
+            reader = "plain"
+        else:
+            reader = "multistream" if workers > 1 else "bz2"
+    if reader == "plain":
+        return open(path, 'rb')
+    if reader == "bz2":
+        return bz2.open(path, 'rb')
+    if reader == "bz2file":
+        from bz2file import BZ2File
+        return BZ2File(path)
+    if reader == "multistream":
+        return MultistreamReader(path, max(workers, 1), index_path or default_index_path(path))
+    raise ValueError("unknown dump reader " + reader)
+
+
+# expat handlers collecting the id (of the page, not of its revisions), title and text of every page.
+class PageParser(object):
+    def __init__(self):
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.buffer_size = 1 << 16
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.characters
+        self.pages = []
+        self.path = []
+        self.doc_id = []
+        self.title = []
+        self.text = []
+        # Chunks of the element being collected, None outside of id, title and text.
+        self.target = None
+
+    def start(self, tag, attrs):
+        self.path.append(tag)
+        if tag == "page":
+            self.doc_id = []
+            self.title = []
+            self.text = []
+        elif len(self.path) >= 2 and self.path[-2] == "page":
+            if tag == "id":
+                self.target = self.doc_id
+            elif tag == "title":
+                self.target = self.title
+        elif tag == "text":
+            self.target = self.text
+
+    def end(self, tag):
+        self.path.pop()
+        self.target = None
+        if tag == "page":
+            self.pages.append(("".join(self.doc_id), "".join(self.title), "".join(self.text)))
+
+    def characters(self, content):
+        if self.target is not None:
+            self.target.append(content)
+
+    def feed(self, data, final=False):
+        self.parser.Parse(data, final)
+
+
+# Generator of (page id, title, text) of the pages of an open dump, read buffer_size bytes at a time.
+def read_pages(f, buffer_size=1 << 20):
+    parser = PageParser()
+    while True:
+        data = f.read(buffer_size)
+        parser.feed(data, len(data) == 0)
+        pages = parser.pages
+        parser.pages = []
+        yield from pages
+        if len(data) == 0:
+            return
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Measure the throughput of reading a dump, without indexing it.")
+    arg_parser.add_argument("dump_path")
+    arg_parser.add_argument("--reader", choices=readers, default="auto")
+    arg_parser.add_argument("--workers", type=int, default=1, help="decompression processes of the multistream reader")
+    arg_parser.add_argument("--dump-index", help="multistream index file of the dump")
+    args = arg_parser.parse_args()
+    logging.basicConfig(level="INFO", format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    start = time.perf_counter()
+    num_bytes = 0
+    with open_dump(args.dump_path, args.reader, args.workers, args.dump_index) as f:
+        data = f.read(1 << 20)
+        while data:
+            num_bytes += len(data)
+            data = f.read(1 << 20)
+    seconds = time.perf_counter() - start
+    print("read   %8.1f MB/s  %8.2f s  %d bytes of XML" % (num_bytes / 1e6 / seconds, seconds, num_bytes))
+
+    start = time.perf_counter()
+    num_pages = 0
+    with open_dump(args.dump_path, args.reader, args.workers, args.dump_index) as f:
+        for _ in read_pages(f):
+            num_pages += 1
+    seconds = time.perf_counter() - start
+    print("parse  %8.1f MB/s  %8.2f s  %d pages, %.1f pages/s" % (num_bytes / 1e6 / seconds, seconds, num_pages,
+                                                                 num_pages / seconds))
@@ -1,67 +1,72 @@
 import os
 import sys
+import shutil
 import time
 import re
-import Stemmer
-import xml.sax
 import math
-from bz2file import BZ2File
-from tokenize import *
-from collections import defaultdict
+import argparse
+import multiprocessing
+import heapq
+import resource
+import logging
+from itertools import groupby, islice
+from operator import itemgetter
+from analysis import tokenize, NLProcessing, analyze, word_pattern, analysis_stats, add_analysis_stats
+from titles import TitleStoreWriter, offsets_path
+from dumps import open_dump, read_pages, readers
+from postings import encode_varint, decode_fields, concat_postings, split_postings, write_record, read_record
+from postings import text_size
+from postings import encode_field_impacts, field_weights, field_acronyms, num_fields
+from segments import new_segment, add_segment, write_build_id, segment_path, read_manifest
+from shards import shard_bases, make_shards, split_titles, publish_shards, unpublish_shards
+from bloom import BloomFilterWriter
+from lexicon import LexiconWriter
+from checkpoint import read_checkpoint, write_checkpoint, remove_checkpoint, clean_intermediates, dump_identity
+from atomic import AtomicFile
+from metrics import metrics
 
 curr_doc_count = 0
-title_file_no = 0
+# Doc number of the first document; non zero when indexing into a segment.
+first_doc_num = 0
 curr_file_num = 0
 total_num_tokens = 0
 num_index_tokens = 0
 num_index_files = 0
-num_fields = 6
-index = defaultdict(dict)
-page_titles = []
-
-field_acronyms = ['b', 'c', 'i', 'l', 'r', 't']
-punctuation = ".,|+-@~`:;?()*\"'=\\&/<>[]{}#!%^$ "
-
-stemmer = Stemmer.Stemmer('english')
-
-check_stopword = defaultdict(int)
-
-with open('stopwords.txt', 'r') as f:
-    for stopword in f:
-        stopword = stopword.strip(' ').strip("\n")
-        check_stopword[stopword] = 1
-f.close()
-
-def num_there(s):
-    return any(i.isdigit() for i in s)
-
-
-def tokenize(content):
-    return re.findall(
-        "[A-Z]{2,}(?![a-z])|[A-Z][a-z]+(?=[A-Z])|[\'\w\-]+", content)
-
-
-def stemWords(content):
-    return stemmer.stemWords(content)
-
-
-def is_noise(content):
-    global punctuation
-    return content in punctuation or len(content) <= 1 or len(content) >= 30
-
-
-def removeNoise(content):
-    return [word for word in content if check_stopword[word] != 1 and not is_noise(word)]
-
-
-# Tokenizing, removing stopwords, stemming.
-def NLProcessing(content):
-    return stemWords(removeNoise(tokenize(content)))
+text_index_size = 0
+index_file_size = 0
+# Dictionary entries per secondary index entry.
+dictionary_block = 128
+# Records per posting file; 0 writes all posting lists to one file, which search memory maps.
+records_per_file = 0
+# False positive rate of the Bloom filter over the "term-field" keys of an index; 0 writes none.
+filter_fp_rate = 0.01
+# Estimated size of the in-memory index at which it is spilled; split between the workers.
+memory_budget = 128 << 20
+index = None
+# Intermediate runs spilled so far, in doc number order.
+spilled_runs = []
+# Index root whose checkpoint.json records the progress of the build; None keeps no checkpoint.
+checkpoint_root = None
+# Dump and segment of the build, recorded with every checkpoint.
+checkpoint_base = {}
+title_store = None
+
+log = logging.getLogger("index")
+
+
+# Precompiled patterns used by the single scan segmenter (WikiDoc.scanContent).
+infobox_pattern = re.compile(r"\{\{\s*infobox")
+brace_pattern = re.compile(r"[{}]")
+section_pattern = re.compile(r"(\[\[\s*category\s*:)|(={2,3}\s*references\s*={2,3})|(={2,3}\s*external\s*links\s*={2,3})")
+category_pattern = re.compile(r"\[\[\s*category\s*:")
+reference_pattern = re.compile(r"={2,3}\s*references\s*={2,3}")
+link_pattern = re.compile(r"={2,3}\s*external\s*links\s*={2,3}")
+template_pattern = re.compile(r"\{\{.*\}\}")
 
 
 # Class handling tokenization, field querying, indexing, etc. of the document content.
 class WikiDoc(object):
-    def __init__(self, doc_num, doc_id, title, text):
+    def __init__(self, doc_num, doc_id, title, text, legacy=False):
         self.doc_num = doc_num
         self.doc_id = doc_id
 
@@ -75,9 +80,65 @@ class WikiDoc(object):
         self.category_words = []
         self.link_words = []
         self.reference_words = []
-        self.processContent()
+        if legacy:
+            self.processContent()
+        else:
+            self.scanContent()
 
-    # Creating inverted index for the document.
+    # Finding all field regions in one pass over the text with precompiled patterns.
+    def scanContent(self):
+        global total_num_tokens
+        text = self.text
+        text_len = len(text)
+        total_num_tokens += len(word_pattern.findall(self.title)) + len(word_pattern.findall(text))
+        self.title_words = analyze(self.title)
+
+        # Infobox: from "{{infobox" up to its matching closing brace.
+        infobox_start = 0
+        infobox_end = 0
+        infobox_tag_instance = infobox_pattern.search(text)
+        if infobox_tag_instance != None:
+            infobox_start = infobox_tag_instance.start()
+            infobox_end = text_len
+            open_braces = 0
+            for brace in brace_pattern.finditer(text, infobox_start):
+                if brace.group() == '{':
+                    open_braces += 1
+                else:
+                    open_braces -= 1
+                    if open_braces == 0:
+                        infobox_end = brace.end()
+                        break
+            self.infobox_words = analyze(infobox_pattern.sub(" ", text[infobox_start: infobox_end]))
+
+        # Section headers after the infobox, scanned once up to the first category.
+        # References and external links each run up to the next header found.
+        cat_start = text_len
+        ref_start = -1
+        links_start = -1
+        for section in section_pattern.finditer(text, infobox_end):
+            if section.lastindex == 1:
+                cat_start = section.start()
+                break
+            elif section.lastindex == 2 and ref_start < 0:
+                ref_start = section.start()
+            elif section.lastindex == 3 and links_start < 0:
+                links_start = section.start()
+        body_end = cat_start
+        if ref_start >= 0:
+            ref_end = links_start if ref_start < links_start else cat_start
+            self.reference_words = analyze(reference_pattern.sub(" ", text[ref_start: ref_end]))
+            body_end = min(body_end, ref_start)
+        if links_start >= 0:
+            links_end = ref_start if links_start < ref_start else cat_start
+            self.link_words = analyze(link_pattern.sub(" ", text[links_start: links_end]))
+            body_end = min(body_end, links_start)
+        if cat_start < text_len:
+            self.category_words = analyze(category_pattern.sub(" ", text[cat_start:]))
+        self.body_words = analyze(template_pattern.sub(" ", text[:infobox_start]) + "\n" +
+                                     template_pattern.sub(" ", text[infobox_end: body_end]))
+
+    # Creating inverted index for the document (legacy segmenter, kept for comparison).
     def processContent(self):
         global total_num_tokens
         total_num_tokens += len(tokenize(self.title + " " + self.text))
@@ -176,316 +237,727 @@ class WikiDoc(object):
                            for x in self.body_words]
 
 
-# XML parser content handler class and index creator for the wikidump.
-class WikiDocHandler(xml.sax.ContentHandler):
+# In-memory index of the documents since the last spill. Every term keeps its postings already
+# in the record format of postings.py: doc gaps, field masks and tfs as varints, in growable
+# byte buffers, so a posting takes a few bytes instead of a dict entry and a list of counts.
+# Documents must be added in doc number order.
+class MemoryIndex(object):
+    # Estimated bytes of a term's entry besides its buffers: dict slot, key, list, bytearrays.
+    term_overhead = 360
+
     def __init__(self):
-        self.tag = ""
-        self.doc_num = 0
-        self.doc_id = ""
-        self.doc_flag = False
-        self.title = ""
-        self.text = ""
+        # term -> [df, last doc number, gaps, masks, tfs]
+        self.terms = {}
+        self.num_postings = 0
+        self.buffer_bytes = 0
+
+    def __len__(self):
+        return len(self.terms)
+
+    # tfs: the tf of the term in every field of the document.
+    def add(self, term, doc_num, tfs):
+        entry = self.terms.get(term)
+        if entry is None:
+            entry = self.terms[term] = [0, 0, bytearray(), bytearray(), bytearray()]
+        gaps = entry[2]
+        size = len(gaps) + len(entry[4])
+        encode_varint(doc_num - entry[1], gaps)
+        mask = 0
+        for i in range(num_fields):
+            if tfs[i]:
+                mask |= 1 << i
+                encode_varint(tfs[i], entry[4])
+        entry[3].append(mask)
+        entry[0] += 1
+        entry[1] = doc_num
+        self.num_postings += 1
+        self.buffer_bytes += len(gaps) + len(entry[4]) - size + 1
+
+    def estimated_bytes(self):
+        return self.buffer_bytes + len(self.terms) * self.term_overhead
+
+    # (term, payload) in term order.
+    def records(self):
+        for term in sorted(self.terms):
+            df, last, gaps, masks, tfs = self.terms[term]
+            out = bytearray()
+            encode_varint(df, out)
+            encode_varint(last, out)
+            encode_varint(len(gaps), out)
+            yield term, bytes(out + gaps + masks + tfs)
+
+    def clear(self):
+        self.terms = {}
+        self.num_postings = 0
+        self.buffer_bytes = 0
+
+
+# Resident set size of the process in bytes, None where /proc is not available.
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+# Peak resident set size of the process in bytes.
+def peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Counting the tfs of each word in every field of the document, then adding its postings.
+# Field slots follow the order of field_acronyms.
+def addDocToIndex(index, doc):
+    field_words = [doc.body_words, doc.category_words, doc.infobox_words,
+                   doc.link_words, doc.reference_words, doc.title_words]
+    doc_tfs = {}
+    for i in range(num_fields):
+        for word in field_words[i]:
+            tfs = doc_tfs.get(word)
+            if tfs is None:
+                tfs = doc_tfs[word] = [0] * num_fields
+            tfs[i] += 1
+    for word, tfs in doc_tfs.items():
+        index.add(word, doc.doc_num, tfs)
+
+
+# Spill the in-memory index as a sorted intermediate run of binary posting records, one per word
+# with the postings of all its fields. Returns the path of the run.
+def writeIntermediateIndex(index, out_path, file_num):
+    start = time.perf_counter()
+    path = out_path + "/intermediates/index_file_" + str(file_num) + ".bin"
+    estimated = index.estimated_bytes()
+    f = AtomicFile(path)
+    for word, payload in index.records():
+        write_record(f, word, payload)
+    metrics.inc("index.spill_bytes", f.tell())
+    metrics.inc("index.spill_postings", index.num_postings)
+    metrics.inc("index.runs")
+    f.close()
+    rss = current_rss()
+    peak = peak_rss()
+    metrics.set("index.peak_rss_bytes", peak)
+    log.info("Spilled run %s: %d terms, %d postings, %.1f MB estimated, RSS %s MB, peak RSS %.1f MB",
+             file_num, len(index), index.num_postings, estimated / 1048576.0,
+             "%.1f" % (rss / 1048576.0) if rss is not None else "?", peak / 1048576.0)
+    metrics.add_time("index.spill", time.perf_counter() - start)
+    return path
+
+
+# Worker side of parallel indexing: process one batch of pages and spill it as its own run, or
+# as several runs (file_num_1, file_num_2, ...) when the batch outgrows memory_budget bytes.
+# Returns the paths of the runs in doc order.
+def indexBatch(out_path, file_num, pages, memory_budget):
+    global total_num_tokens
+    start_tokens = total_num_tokens
+    start_stats = dict(analysis_stats)
+    start_metrics = metrics.snapshot()
+    batch_index = MemoryIndex()
+    batch_paths = []
+    for doc_num, doc_id, title, text in pages:
+        with metrics.timer("index.segment"):
+            doc = WikiDoc(doc_num, doc_id, title, text)
+        with metrics.timer("index.add"):
+            addDocToIndex(batch_index, doc)
+        if batch_index.estimated_bytes() >= memory_budget:
+            batch_paths.append(writeIntermediateIndex(batch_index, out_path,
+                                                      str(file_num) + "_" + str(len(batch_paths) + 1)))
+            batch_index.clear()
+    if len(batch_index) > 0:
+        name = str(file_num) + "_" + str(len(batch_paths) + 1) if batch_paths else file_num
+        batch_paths.append(writeIntermediateIndex(batch_index, out_path, name))
+    return (batch_paths, total_num_tokens - start_tokens,
+            {key: analysis_stats[key] - start_stats[key] for key in analysis_stats}, metrics.delta(start_metrics))
+
+
+# Page handler and index creator for the wikidump.
+# With a process pool, pages are handed to the workers in batches instead of being indexed inline.
+class WikiDocHandler(object):
+    def __init__(self, pool=None, batch_size=5000, max_pending=0, memory_budget=memory_budget):
+        self.pool = pool
+        self.memory_budget = memory_budget
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.batch = []
+        self.pending = []
+        # Seconds spent handling complete pages, so the expat parsing time of read_pages
+        # (index.parse) can be told apart.
+        self.page_seconds = 0.0
 
     def updateIndex(self, doc):
-        global index, inv_index_out_path, field_acronyms, curr_file_num, num_fields, page_titles, title_file_no, curr_doc_count
-
-        # Updating word count for each field in the document they appeared in.
-        for word in doc.title_words:
-            if not num_there(word):
-                word = word.strip('-_')
-                try:
-                    index[word][doc.doc_num]
-                except:
-                    index[word][doc.doc_num] = [0] * num_fields
-                index[word][doc.doc_num][0] += 1
-        for word in doc.body_words:
-            if not num_there(word):
-                word = word.strip('-_')
-                try:
-                    index[word][doc.doc_num]
-                except:
-                    index[word][doc.doc_num] = [0] * num_fields
-                index[word][doc.doc_num][1] += 1
-        for word in doc.infobox_words:
-            if not num_there(word):
-                word = word.strip('-_')
-                try:
-                    index[word][doc.doc_num]
-                except:
-                    index[word][doc.doc_num] = [0] * num_fields
-                index[word][doc.doc_num][2] += 1
-        for word in doc.category_words:
-            if not num_there(word):
-                word = word.strip('-_')
-                try:
-                    index[word][doc.doc_num]
-                except:
-                    index[word][doc.doc_num] = [0] * num_fields
-                index[word][doc.doc_num][3] += 1
-        for word in doc.link_words:
-            if not num_there(word):
-                word = word.strip('-_')
-                try:
-                    index[word][doc.doc_num]
-                except:
-                    index[word][doc.doc_num] = [0] * num_fields
-                index[word][doc.doc_num][4] += 1
-        for word in doc.reference_words:
-            if not num_there(word):
-                word = word.strip('-_')
-                try:
-                    index[word][doc.doc_num]
-                except:
-                    index[word][doc.doc_num] = [0] * num_fields
-                index[word][doc.doc_num][5] += 1
-
-        # sample --- sachin-t:d1-1|d5-1
-        if curr_doc_count % 20000 == 0 and curr_doc_count:
-            curr_file_num += 1
-            f = open(inv_index_out_path + "/intermediates/index_file_" +
-                     str(curr_file_num) + ".txt", "w+")
-            title_f = open(f'titles/titles_{title_file_no}.txt', 'w+')
-            for page_title in page_titles:
-                title_f.write(page_title.strip()+'\n')
-            title_file_no += 1
-            page_titles.clear()
-            title_f.close()
-
-        if len(index) % 20000 == 0 and len(index):
+        global curr_file_num
+
+        with metrics.timer("index.add"):
+            addDocToIndex(index, doc)
+
+        if index.estimated_bytes() >= memory_budget:
             curr_file_num += 1
-            f = open(inv_index_out_path + "/intermediates/index_file_" +
-                     str(curr_file_num) + ".txt", "w+")
-            word_list = sorted(index.keys())
-            for word in (word_list):
-                for i in range(len(field_acronyms)):
-                    line = ""
-                    line = word + "-" + field_acronyms[i] + ":"
-                    docs = index[word]
-                    flag = 0
-                    for doc in (sorted(docs.keys())):
-                        if index[word][doc][i]:
-                            line = line + "d" + str(doc) + "-"
-                            line = line + str(index[word][doc][i])
-                            line = line + "|"
-                            flag = 1
-                    if flag == 0:
-                        line = ""
-                    if len(line) > 0 and line[-1] == "|":
-                        line = line[:-1]
-                    f.write(line)
-                    if len(line) > 0:
-                        f.write("\n")
-            f.close()
+            spilled_runs.append(writeIntermediateIndex(index, inv_index_out_path, curr_file_num))
             index.clear()
-            index = defaultdict(dict)
-
-    def reset(self):
-        self.tag = ""
-        self.doc_num = 0
-        self.doc_id = ""
-        self.doc_flag = False
-        self.title = ""
-        self.text = ""
-
-    def startElement(self, tag, attrs):
-        self.tag = tag
-
-    def endElement(self, tag):
-        global curr_doc_count, page_titles
-        if (tag == "page"):
-            doc = WikiDoc(curr_doc_count, self.doc_id, self.title, self.text)
-            page_titles.append(self.title.lower())
+            saveCheckpoint("index", doc.doc_num + 1 - first_doc_num, spilled_runs)
+
+    def submitBatch(self):
+        global curr_file_num
+        curr_file_num += 1
+        self.pending.append((self.pool.apply_async(
+            indexBatch, (inv_index_out_path, curr_file_num, self.batch, self.memory_budget)), self.batch[-1][0] + 1))
+        self.batch = []
+        # Bound the number of batches held in memory.
+        while len(self.pending) > self.max_pending:
+            self.collectBatch()
+
+    def collectBatch(self):
+        global total_num_tokens
+        result, end_doc = self.pending.pop(0)
+        batch_paths, num_tokens, stats, worker_metrics = result.get()
+        spilled_runs.extend(batch_paths)
+        total_num_tokens += num_tokens
+        add_analysis_stats(stats)
+        metrics.merge(worker_metrics)
+        saveCheckpoint("index", end_doc - first_doc_num, spilled_runs)
+
+    def finishBatches(self):
+        if len(self.batch) > 0:
+            self.submitBatch()
+        while len(self.pending) > 0:
+            self.collectBatch()
+
+    def addPage(self, doc_id, title, text):
+        global curr_doc_count
+        start = time.perf_counter()
+        title_store.add(doc_id, title.lower())
+        if self.pool is not None:
+            self.batch.append((curr_doc_count, doc_id, title, text))
+            if len(self.batch) >= self.batch_size:
+                self.submitBatch()
+        else:
+            with metrics.timer("index.segment"):
+                doc = WikiDoc(curr_doc_count, doc_id, title, text)
             self.updateIndex(doc)
             del doc
-            curr_doc_count += 1
-            print(curr_doc_count, end="\r")
-            self.reset()
-
-    def characters(self, content):
-        if self.tag == "id" and self.doc_flag == False:
-            self.doc_id = content
-            self.doc_flag = True
-        elif self.tag == "title":
-            self.title += content
-        elif self.tag == "text":
-            self.text += content
+        curr_doc_count += 1
+        metrics.inc("index.pages")
+        if curr_doc_count % 10000 == 0:
+            log.info("Indexed %d pages", curr_doc_count)
+        self.page_seconds += time.perf_counter() - start
 
 
 def writeIndexStatFile():
-    global total_num_tokens, num_index_tokens, index, curr_doc_count, num_index_files
-    f = open(inv_index_out_path + "my_stat.txt", "w+")
-    f.write(str(total_num_tokens) + "\n" + str(num_index_tokens) + "\n" + str(curr_doc_count))
+    global total_num_tokens, num_index_tokens, index, curr_doc_count, num_index_files, text_index_size
+    f = open(inv_index_out_path + "/my_stat.txt", "w+")
+    f.write(str(total_num_tokens) + "\n" + str(num_index_tokens) + "\n" + str(curr_doc_count - first_doc_num))
     f.close()
-    # index size in GB (for e.g. 17.36) -> size of inv_index_out_path + '/final_index' + '.txt'
+    # index size in GB (for e.g. 17.36) -> total size of inv_index_out_path + '/indexes'
     # number of files in which the inverted index is split (for e.g. 26)
     # number of tokens in the inverted index (for e.g. 872985644)
-    index_file_size = os.path.getsize(inv_index_out_path + '/final_index' + '.txt')
+    # size in GB the same index would take in the old text format
+    # size reduction of the binary format (text size / binary size)
+    # hit rate of the token -> term cache during analysis
+    # analysis throughput in tokens per second
     p = math.pow(1024, 3)
     s = round(index_file_size / p, 2)
+    reduction = round(text_index_size / max(index_file_size, 1), 2)
+    lookups = analysis_stats["hits"] + analysis_stats["misses"]
+    hit_rate = round(analysis_stats["hits"] / max(lookups, 1), 4)
+    throughput = round(analysis_stats["tokens"] / max(analysis_stats["seconds"], 1e-9))
     f = open(inv_index_stat_path + "/stats.txt", "w+")
-    f.write(str(s) + "\n" + str(num_index_files) + "\n" + str(num_index_tokens))
+    f.write(str(s) + "\n" + str(num_index_files) + "\n" + str(num_index_tokens) + "\n" +
+            str(round(text_index_size / p, 2)) + "\n" + str(reduction) + "\n" +
+            str(hit_rate) + "\n" + str(throughput))
     f.close()
 
 
-# sample --- sachin-t:d1-1|d5-1
-def merge2Files(left_id, right_id):
-    f1 = open(inv_index_out_path + '/intermediates/index_file_' +
-              str(left_id) + '.txt', 'r')
-    f2 = open(inv_index_out_path + '/intermediates/index_file_' +
-              str(right_id) + '.txt', 'r')
-
-    tmp = open(inv_index_out_path + '/intermediates/tmp_index_file.txt', 'w+')
-
-    print("Merging " + str(left_id) + " and " + str(right_id))
-
-    l1 = f1.readline()
-    l2 = f2.readline()
-
-    while (l1 and l2):
-        while len(l1.split(':')) <= 1:
-            l1 = f1.readline()
-        line1 = l1.split(':')
-        key1 = line1[0]
-        postlist1 = line1[1]
-        while len(l2.split(':')) <= 1:
-            l2 = f2.readline()
-        line2 = l2.split(':')
-        key2 = line2[0]
-        postlist2 = line2[1]
-
-        if key1 < key2:
-            tmp.write(l1)
-            l1 = f1.readline()
-        elif key1 > key2:
-            tmp.write(l2)
-            l2 = f2.readline()
-        else:
-            tmp.write(key1 + ':' + postlist1.strip() + "|" + postlist2)
-            l1 = f1.readline()
-            l2 = f2.readline()
-
-    while (l1):
-        tmp.write(l1)
-        l1 = f1.readline()
-    while (l2):
-        tmp.write(l2)
-        l2 = f2.readline()
-
-    f1.close()
-    f2.close()
-    tmp.close()
-
-    # Remove children.
-    os.remove(inv_index_out_path + '/intermediates/index_file_' +
-              str(left_id) + '.txt')
-    os.remove(inv_index_out_path + '/intermediates/index_file_' +
-              str(right_id) + '.txt')
-    # Update Parent.
-    os.rename(inv_index_out_path + '/intermediates/tmp_index_file.txt',
-              inv_index_out_path + '/intermediates/index_file_' + str(right_id // 2)+'.txt')
-
-
-def mergeFiles():
-    end = curr_file_num
-    while end > 1:
-        for i in range(1, end, 2):
-            merge2Files(i, i + 1)
-        if end % 2 == 1:
-            os.rename(inv_index_out_path + '/intermediates/index_file_' + str(end) + '.txt',
-                      inv_index_out_path + '/intermediates/index_file_' + str(end // 2 + 1) + '.txt')
-        if end % 2 == 1:
-            end = end // 2 + 1
+# Sorted records of one run, read through a large buffer.
+def runRecords(path, buffer_size):
+    f = open(path, 'rb', buffering=buffer_size)
+    record = read_record(f)
+    while record:
+        yield record
+        record = read_record(f)
+    f.close()
+
+
+# k-way merge of runs with a heap. Runs must be given in doc number order; heapq.merge
+# keeps equal keys in run order, so their posting lists can simply be concatenated.
+def mergeRuns(run_paths, buffer_size):
+    runs = [runRecords(path, buffer_size) for path in run_paths]
+    merged = heapq.merge(*runs, key=itemgetter(0))
+    for key, group in groupby(merged, key=itemgetter(0)):
+        yield key, concat_postings([payload for _, payload in group])
+
+
+def mergeIntermediate(run_paths, file_num, buffer_size):
+    path = inv_index_out_path + '/intermediates/index_file_' + str(file_num) + '.bin'
+    log.info("Merging %d files into %d", len(run_paths), file_num)
+    start = time.perf_counter()
+    f = AtomicFile(path, buffer_size=buffer_size)
+    for key, payload in mergeRuns(run_paths, buffer_size):
+        write_record(f, key, payload)
+    f.close()
+    metrics.add_time("index.merge", time.perf_counter() - start)
+    return path
+
+
+# Writes the posting files, the term dictionary and the secondary index of one index directory.
+# sample --- dictionary.txt: "sachin 0 1024 4 0 0 0 0 6 1 0 0 0 0 2" -> term, index file, payload offset,
+# payload length, then the df and the max tf of every field, in field_acronyms order (0 where the term is absent)
+# secondary_index.txt holds every dictionary_block-th dictionary key with its byte offset in dictionary.txt.
+# vocabulary.bloom is a Bloom filter (bloom.py) over the "term-field" keys with postings, and
+# lexicon.bin the front coded list of the terms with their dfs (lexicon.py).
+class IndexWriter(object):
+    def __init__(self, out_path, buffer_size):
+        self.out_path = out_path
+        self.buffer_size = buffer_size
+        self.dictionary = open(out_path + '/dictionary.txt', 'w+', buffering=buffer_size)
+        self.secondary_index = open(out_path + '/secondary_index.txt', 'w+')
+        self.fin_index = None
+        self.file_num = -1
+        self.fin_offset = 0
+        self.dictionary_offset = 0
+        self.num_records = 0
+        self.index_bytes = 0
+        # Posting files of an earlier build would be mapped by search along with the new ones.
+        for file_name in os.listdir(out_path + '/indexes'):
+            os.remove(out_path + '/indexes/' + file_name)
+        self.lexicon = LexiconWriter(out_path + '/lexicon.bin')
+        self.vocabulary = None
+        if filter_fp_rate > 0:
+            self.vocabulary = BloomFilterWriter(out_path + '/vocabulary.bloom', filter_fp_rate)
+        elif os.path.exists(out_path + '/vocabulary.bloom'):
+            os.remove(out_path + '/vocabulary.bloom')
+        # Impact lists of an earlier build would not match the new dictionary; writeImpactIndex
+        # writes them again when asked for.
+        if os.path.exists(out_path + '/impacts.txt'):
+            os.remove(out_path + '/impacts.txt')
+        if os.path.exists(out_path + '/impacts'):
+            shutil.rmtree(out_path + '/impacts')
+
+    # Records must be added in key order. fields: the decoded postings of the record; dfs, if
+    # given, are written instead of the dfs of fields.
+    def add(self, key, payload, fields, dfs=None):
+        global num_index_files
+        if self.fin_index is None or (records_per_file > 0 and self.num_records % records_per_file == 0):
+            self.closeIndexFile()
+            self.file_num += 1
+            self.fin_index = open(self.out_path + '/indexes/index_' + str(self.file_num) + '.bin',
+                                  'wb', buffering=self.buffer_size)
+            num_index_files += 1
+        self.fin_offset += write_record(self.fin_index, key, payload)
+        if dfs is None:
+            dfs = [len(fields[i][0]) for i in range(num_fields)]
+        self.lexicon.add(key, dfs)
+        max_tfs = [max(fields[i][1], default=0) for i in range(num_fields)]
+        line = (key + " " + str(self.file_num) + " " + str(self.fin_offset - len(payload)) + " " +
+                str(len(payload)) + " " + " ".join(map(str, dfs)) + " " + " ".join(map(str, max_tfs)) + "\n")
+        if self.num_records % dictionary_block == 0:
+            self.secondary_index.write(key + " " + str(self.dictionary_offset) + "\n")
+        self.dictionary.write(line)
+        self.dictionary_offset += len(line.encode('utf-8'))
+        self.num_records += 1
+        if self.vocabulary is not None:
+            self.vocabulary.add(key, [i for i in range(num_fields) if len(fields[i][0]) > 0])
+
+    # Adds a term without postings in this index to the lexicon only: the shards of an index
+    # share the lexicon of the whole index.
+    def addLexiconTerm(self, key, dfs):
+        self.lexicon.add(key, dfs)
+
+    def closeIndexFile(self):
+        if self.fin_index is not None:
+            self.index_bytes += self.fin_offset
+            self.fin_index.close()
+            self.fin_index = None
+            self.fin_offset = 0
+
+    def close(self):
+        global index_file_size
+        self.closeIndexFile()
+        self.dictionary.close()
+        self.secondary_index.close()
+        self.lexicon.close()
+        index_file_size += self.index_bytes
+        metrics.inc("index.index_bytes", self.index_bytes)
+        if self.vocabulary is not None:
+            with metrics.timer("index.filter"):
+                vocabulary = self.vocabulary.close()
+            metrics.inc("index.filter_bytes", vocabulary.size())
+            log.info("Vocabulary filter of %s: %d keys, %d KB (%.1f bits per key, %d hashes), "
+                     "false positive rate %.4f", self.out_path, vocabulary.num_keys, vocabulary.size() // 1024,
+                     vocabulary.num_bits / max(vocabulary.num_keys, 1), vocabulary.num_hashes,
+                     vocabulary.fp_rate())
+
+
+# Counts a final record in the index statistics.
+def countRecord(key, fields):
+    global num_index_tokens, text_index_size
+    num_index_tokens += 1
+    for i in range(num_fields):
+        if len(fields[i][0]) > 0:
+            text_index_size += text_size(key + "-" + field_acronyms[i], fields[i][0], fields[i][1])
+
+
+# Final merge pass: writes the index files, the dictionary and the secondary index of out_path.
+# records: sorted (key, payload) pairs.
+def writeFinalIndex(records, out_path, buffer_size):
+    writer = IndexWriter(out_path, buffer_size)
+    for key, payload in records:
+        fields = decode_fields(payload)
+        writer.add(key, payload, fields)
+        countRecord(key, fields)
+    writer.close()
+
+
+# Final merge pass of a sharded index: every posting list is split at the first doc numbers
+# of the shards (bases) and each part is written to its shard, with the dfs of the whole list.
+# The lexicon of every shard holds all terms of the index.
+def writeShardedIndex(records, paths, bases, buffer_size):
+    writers = [IndexWriter(path, buffer_size) for path in paths]
+    for key, payload in records:
+        fields = decode_fields(payload)
+        dfs = [len(fields[i][0]) for i in range(num_fields)]
+        for writer, part in zip(writers, split_postings(payload, bases)):
+            if part is not None:
+                writer.add(key, part, decode_fields(part), dfs)
+            else:
+                writer.addLexiconTerm(key, dfs)
+        countRecord(key, fields)
+    for writer in writers:
+        writer.close()
+
+
+# Field weight * idf: the score of a posting is this times log2(tf + 1), as in search.py.
+def termFactor(field, df, num_docs):
+    return field_weights[field] * math.log2(num_docs / (df + 1))
+
+
+# Impact pass over the final index: quantizes the score contribution of every posting to bits
+# bits and writes the impact ordered lists of every term's fields to impacts/impact_N.bin
+# (N matching the index file). The quantization step is set by the highest impact in the index,
+# which the dictionary gives without reading postings (df and max tf of every field).
+# Dictionary lines get two more columns, the offset and length of the term's impact record:
+# "sachin 0 1024 4 0 0 0 0 6 1 0 0 0 0 2 512 9" -> ..., impact offset, impact length
+# impacts.txt holds the number of bits, the highest impact and the number of documents.
+def writeImpactIndex(out_path, num_docs, bits=8, buffer_size=1 << 20):
+    max_impact = 0.0
+    with open(out_path + '/dictionary.txt', 'r') as f:
+        for line in f:
+            values = [int(val) for val in line.split()[4:]]
+            for i in range(num_fields):
+                if values[i] > 0:
+                    max_impact = max(max_impact, termFactor(field_acronyms[i], values[i], num_docs) *
+                                     math.log2(values[num_fields + i] + 1))
+    levels = (1 << bits) - 1
+    scale = levels / max_impact if max_impact > 0 else 0.0
+    os.makedirs(out_path + '/impacts', exist_ok=True)
+    dictionary = open(out_path + '/dictionary.txt', 'r')
+    new_dictionary = open(out_path + '/dictionary.txt.tmp', 'w', buffering=buffer_size)
+    secondary_index = open(out_path + '/secondary_index.txt.tmp', 'w')
+    index_file = None
+    impact_file = None
+    file_num = -1
+    impact_offset = 0
+    dictionary_offset = 0
+    for num_records, line in enumerate(dictionary):
+        key, entry_file, offset, length = line.split()[:4]
+        if int(entry_file) != file_num:
+            if index_file is not None:
+                index_file.close()
+                impact_file.close()
+            file_num = int(entry_file)
+            index_file = open(out_path + '/indexes/index_' + entry_file + '.bin', 'rb', buffering=buffer_size)
+            impact_file = open(out_path + '/impacts/impact_' + entry_file + '.bin', 'wb', buffering=buffer_size)
+            impact_offset = 0
+        index_file.seek(int(offset))
+        field_impacts = []
+        for i, (doc_nums, tfs) in decode_fields(index_file.read(int(length))).items():
+            factor = scale * termFactor(field_acronyms[i], len(doc_nums), num_docs)
+            # Postings keep at least impact 1, so every matching document is still found.
+            field_impacts.append((doc_nums, [max(int(round(factor * math.log2(tf + 1))), 1) for tf in tfs]))
+        payload = encode_field_impacts(field_impacts)
+        impact_file.write(payload)
+        # Impact columns written by an interrupted build are replaced.
+        new_line = (" ".join(line.split()[:4 + 2 * num_fields]) + " " + str(impact_offset) + " " +
+                    str(len(payload)) + "\n")
+        impact_offset += len(payload)
+        if num_records % dictionary_block == 0:
+            secondary_index.write(key + " " + str(dictionary_offset) + "\n")
+        new_dictionary.write(new_line)
+        dictionary_offset += len(new_line.encode('utf-8'))
+        metrics.inc("index.impact_bytes", len(payload))
+    if index_file is not None:
+        index_file.close()
+        impact_file.close()
+    dictionary.close()
+    new_dictionary.close()
+    secondary_index.close()
+    os.rename(out_path + '/dictionary.txt.tmp', out_path + '/dictionary.txt')
+    os.rename(out_path + '/secondary_index.txt.tmp', out_path + '/secondary_index.txt')
+    with open(out_path + '/impacts.txt', 'w') as f:
+        f.write(str(bits) + "\n" + str(max_impact) + "\n" + str(num_docs))
+
+
+# Merge all intermediate runs, at most fan_in at a time, in as few passes as possible.
+# With num_shards > 1 the last pass writes the shards of a sharded index instead.
+def mergeFiles(fan_in=128, buffer_size=1 << 20, num_shards=1):
+    global curr_file_num
+    # Leave file descriptors for everything else the process has open.
+    fd_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if fd_limit != resource.RLIM_INFINITY:
+        fan_in = min(fan_in, fd_limit - 16)
+    fan_in = max(fan_in, 2)
+    run_paths = list(spilled_runs)
+    while len(run_paths) > fan_in:
+        metrics.inc("index.merge_passes")
+        next_paths = []
+        for i in range(0, len(run_paths), fan_in):
+            group = run_paths[i: i + fan_in]
+            if len(group) == 1:
+                next_paths.append(run_paths[i])
+                continue
+            curr_file_num += 1
+            next_paths.append(mergeIntermediate(group, curr_file_num, buffer_size))
+            # The merged runs are removed once the checkpoint no longer refers to them.
+            saveCheckpoint("merge", curr_doc_count - first_doc_num, next_paths + run_paths[i + fan_in:])
+            for run_path in group:
+                os.remove(run_path)
+        run_paths = next_paths
+    log.info("Merging %d files into the final index", len(run_paths))
+    metrics.inc("index.merge_passes")
+    with metrics.timer("index.final_merge"):
+        if num_shards > 1:
+            bases = shard_bases(curr_doc_count, num_shards)
+            writeShardedIndex(mergeRuns(run_paths, buffer_size), make_shards(inv_index_out_path, num_shards),
+                              bases, buffer_size)
         else:
-            end = end // 2
-    os.rename(inv_index_out_path + '/intermediates/index_file_1.txt', inv_index_out_path + '/final_index' + '.txt')
-
-
-def main(wiki_xml_dump):
-    global index, curr_file_num, title_file_no
-    parser = xml.sax.make_parser()
-    parser.setFeature(xml.sax.handler.feature_namespaces, 0)
-    handler = WikiDocHandler()
-    parser.setContentHandler(handler)
-    parser.parse(wiki_xml_dump)
-    if len(page_titles) > 0:
-        title_f = open(inv_index_out_path + '/titles/titles_' + str(title_file_no) + '.txt', 'w+')
-        for page_title in page_titles:
-            title_f.write(page_title)
-    if curr_doc_count % 20000 != 0:
+            writeFinalIndex(mergeRuns(run_paths, buffer_size), inv_index_out_path, buffer_size)
+    saveCheckpoint("merged", curr_doc_count - first_doc_num, [])
+    for run_path in run_paths:
+        os.remove(run_path)
+
+
+# Records the progress of the build in the checkpoint. pages: pages of the dump indexed into
+# run_paths and written to the title store.
+def saveCheckpoint(phase, pages, run_paths):
+    if checkpoint_root is None:
+        return
+    start = time.perf_counter()
+    if phase == "index":
+        title_store.sync()
+    stats = {"tokens": total_num_tokens, "analysis": dict(analysis_stats)}
+    if phase == "merged":
+        stats.update({"index_tokens": num_index_tokens, "index_files": num_index_files,
+                      "text_index_size": text_index_size, "index_file_size": index_file_size})
+    state = dict(checkpoint_base)
+    state.update({"phase": phase, "pages": pages,
+                  "runs": {"files": [os.path.basename(path) for path in run_paths], "file_num": curr_file_num},
+                  "stats": stats})
+    write_checkpoint(checkpoint_root, state)
+    metrics.inc("index.checkpoints")
+    metrics.add_time("index.checkpoint", time.perf_counter() - start)
+    log.debug("Checkpoint: %s, %d pages, %d runs", phase, pages, len(run_paths))
+
+
+# File wrapper timing the reads, i.e. the decompression of the dump.
+class TimedReader(object):
+    def __init__(self, f):
+        self.f = f
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.f.read(size)
+        seconds = time.perf_counter() - start
+        self.seconds += seconds
+        metrics.add_time("index.decompress", seconds)
+        metrics.inc("index.dump_bytes", len(data))
+        return data
+
+
+# resume_pages: pages of the dump already indexed into the runs before a checkpoint; they are
+# parsed again but not indexed.
+def main(wiki_xml_dump, num_workers=1, batch_size=5000, resume_pages=0):
+    global index, curr_file_num, title_store
+    title_store = TitleStoreWriter(inv_index_out_path + '/titles.bin', resume_pages)
+    index = MemoryIndex()
+    pool = None
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers)
+    handler = WikiDocHandler(pool, batch_size, 2 * num_workers, memory_budget // num_workers)
+    reader = TimedReader(wiki_xml_dump)
+    start = time.perf_counter()
+    for doc_id, title, text in islice(read_pages(reader), resume_pages, None):
+        handler.addPage(doc_id, title, text)
+    # Parsing is the time of the loop less decompression (reads) and the handling of pages.
+    metrics.add_time("index.parse", time.perf_counter() - start - handler.page_seconds - reader.seconds)
+    if pool is not None:
+        handler.finishBatches()
+        pool.close()
+        pool.join()
+    title_store.close()
+    if len(index) > 0:
         curr_file_num += 1
-        f = open(inv_index_out_path + "/intermediates/index_file_" +
-                 str(curr_file_num) + ".txt", "w+")
-        word_list = sorted(index.keys())
-        for word in (word_list):
-            for i in range(len(field_acronyms)):
-                line = ""
-                line = word + "-" + field_acronyms[i] + ":"
-                docs = index[word]
-                for doc in (sorted(docs.keys())):
-                    line = line + "d" + str(doc) + "-"
-                    if index[word][doc][i]:
-                        line = line + str(index[word][doc][i])
-                        line = line + "|"
-                    else:
-                        line = ""
-                if len(line) > 0 and line[-1] == "|":
-                    line = line[:-1]
-                f.write(line)
-                if len(line) > 0:
-                    f.write("\n")
+        spilled_runs.append(writeIntermediateIndex(index, inv_index_out_path, curr_file_num))
         index.clear()
-        f.close()
-    mergeFiles()
-
-# Splitting the final index in smaller files and storing secondary index.
-def split_final_index():
-    global num_index_tokens, num_index_files
-    num_final_index_lines = 0
-    final_index = open(inv_index_out_path + '/final_index' + '.txt', 'r')
-    secondary_index = open(inv_index_out_path + '/secondary_index.txt', 'w+')
-    line = final_index.readline().strip('\n')
-    num_final_index_lines += 1
-    lines = []
-    last_word = ""
-    while line:
-        lines.append(line)
-        curr_word = line.split(":")[0][:-2]
-        if curr_word != last_word:
-            last_word = curr_word
-            num_index_tokens += 1
-        if len(lines) % 10000 == 0:
-            secondary_index.write(lines[0].split(":")[0] + '\n')
-            fin_index = open(inv_index_out_path + '/indexes/index_' + str(num_index_files) + '.txt', 'w+')
-            for l in lines:
-                fin_index.write(l + '\n')
-            fin_index.close()
-            num_index_files += 1
-            lines = []
-            fin_index.close()
-        line = final_index.readline().strip('\n')
-        num_final_index_lines += 1
-    # print(num_final_index_lines)
-    # print(num_index_tokens)
-    final_index.close()
-    secondary_index.close()
-
-wiki_dump_in_path = sys.argv[1]
-inv_index_out_path = sys.argv[2]
-inv_index_stat_path = sys.argv[3]
+    saveCheckpoint("merge", curr_doc_count - first_doc_num, spilled_runs)
+    if os.path.exists(offsets_path(inv_index_out_path + '/titles.bin')):
+        os.remove(offsets_path(inv_index_out_path + '/titles.bin'))
+    log.info("Peak RSS %.1f MB", peak_rss() / 1048576.0)
 
 if __name__ == "__main__":
-    path = os.path.join(inv_index_out_path, "intermediates")
-    if not os.path.exists(path):
-        os.mkdir(path)
-    st = 0
-    with BZ2File(wiki_dump_in_path) as wiki_xml_dump:
-        st = time.time()
-        main(wiki_xml_dump)
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("wiki_dump_in_path")
+    arg_parser.add_argument("inv_index_out_path")
+    arg_parser.add_argument("inv_index_stat_path")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="number of indexing processes (1 indexes inline)")
+    arg_parser.add_argument("--batch-size", type=int, default=5000,
+                            help="pages per batch handed to a worker")
+    arg_parser.add_argument("--reader", choices=readers, default="auto",
+                            help="how the dump is read: plain XML, bz2, bz2file (pure Python), multistream "
+                                 "(parallel decompression of a multistream dump), or auto (by file name)")
+    arg_parser.add_argument("--reader-workers", type=int, default=1,
+                            help="decompression processes of the multistream reader")
+    arg_parser.add_argument("--dump-index", metavar="FILE",
+                            help="multistream index of the dump (default: <dump>-index.txt.bz2 if it exists)")
+    arg_parser.add_argument("--memory-budget-mb", type=int, default=memory_budget >> 20,
+                            help="spill the in-memory index once its estimated size reaches this many MB "
+                                 "(shared by the workers)")
+    arg_parser.add_argument("--merge-fan-in", type=int, default=128,
+                            help="maximum number of files merged in one pass")
+    arg_parser.add_argument("--merge-buffer-kb", type=int, default=1024,
+                            help="read/write buffer per merged file")
+    arg_parser.add_argument("--resume", action="store_true",
+                            help="go on from the checkpoint of an interrupted build of the same dump instead of "
+                                 "starting from the first page")
+    arg_parser.add_argument("--segment", action="store_true",
+                            help="add the dump as a new segment of the index in inv_index_out_path")
+    arg_parser.add_argument("--delete-ids", metavar="FILE",
+                            help="with --segment, also delete the pages whose ids are listed in FILE")
+    arg_parser.add_argument("--shards", type=int, default=1,
+                            help="build this many document-partitioned shards, each over its own doc range")
+    arg_parser.add_argument("--records-per-file", type=int, default=records_per_file,
+                            help="split the posting lists into files of this many terms; 0 (the default) writes "
+                                 "one consolidated file")
+    arg_parser.add_argument("--filter-fp-rate", type=float, default=filter_fp_rate,
+                            help="false positive rate of the Bloom filter over the term-field keys, which sets "
+                                 "its size (about 10 bits per key at 0.01); 0 writes no filter")
+    arg_parser.add_argument("--impacts", action="store_true",
+                            help="also write quantized impact ordered posting lists (search --ranking impact)")
+    arg_parser.add_argument("--impact-bits", type=int, default=8, help="bits per quantized impact")
+    arg_parser.add_argument("--log-level", default="info", choices=["debug", "info", "warning", "error"])
+    arg_parser.add_argument("--metrics", metavar="FILE", help="write a metrics snapshot to FILE at the end of the run")
+    arg_parser.add_argument("--metrics-format", choices=["json", "prometheus"], default="json")
+    arg_parser.add_argument("--metrics-interval", type=float, default=0,
+                            help="also write the snapshot every METRICS_INTERVAL seconds during the run")
+    args = arg_parser.parse_args()
+    if args.impacts and (args.segment or args.shards > 1):
+        arg_parser.error("--impacts needs a plain index and cannot be used with --segment or --shards")
+    if args.segment and args.shards > 1:
+        arg_parser.error("--segment and --shards cannot be combined")
+    if not 0 <= args.filter_fp_rate < 1:
+        arg_parser.error("--filter-fp-rate must be in [0, 1)")
+    filter_fp_rate = args.filter_fp_rate
+    records_per_file = args.records_per_file
+    memory_budget = args.memory_budget_mb << 20
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if args.metrics and args.metrics_interval > 0:
+        metrics.start_reporter(args.metrics, args.metrics_format, args.metrics_interval)
+    wiki_dump_in_path = args.wiki_dump_in_path
+    inv_index_out_path = args.inv_index_out_path
+    inv_index_stat_path = args.inv_index_stat_path
+    index_root = inv_index_out_path
+    delete_ids = set()
+    if args.delete_ids:
+        with open(args.delete_ids, 'r') as f:
+            delete_ids = set(line.strip() for line in f if line.strip())
+    checkpoint = read_checkpoint(index_root) if args.resume else None
+    if args.resume and checkpoint is None:
+        log.warning("No checkpoint in %s, indexing from the first page", index_root)
+    if checkpoint is not None:
+        if checkpoint["dump"] != dump_identity(wiki_dump_in_path):
+            arg_parser.error("the checkpoint in " + index_root + " is of another dump")
+        if (checkpoint["segment"] is not None) != args.segment:
+            arg_parser.error("the checkpoint in " + index_root + " is of a build " +
+                             ("with" if checkpoint["segment"] is not None else "without") + " --segment")
+    else:
+        remove_checkpoint(index_root)
+    if args.segment:
+        if checkpoint is not None:
+            segment_name = checkpoint["segment"]["name"]
+            first_doc_num = checkpoint["segment"]["first_doc_num"]
+            inv_index_out_path = segment_path(index_root, segment_name)
+            if read_manifest(index_root)["next_doc_num"] != first_doc_num:
+                arg_parser.error("segment " + segment_name + " of the checkpoint was already added, or another "
+                                 "segment was added since")
+        else:
+            segment_name, inv_index_out_path, first_doc_num = new_segment(index_root)
+        curr_doc_count = first_doc_num
+    else:
+        unpublish_shards(index_root)
+
+    for dir_name in ["intermediates", "indexes"]:
+        path = os.path.join(inv_index_out_path, dir_name)
+        if not os.path.exists(path):
+            os.mkdir(path)
+    intermediates_path = os.path.join(inv_index_out_path, "intermediates")
+    checkpoint_root = index_root
+    checkpoint_base = {"dump": dump_identity(wiki_dump_in_path),
+                       "segment": {"name": segment_name, "first_doc_num": first_doc_num} if args.segment else None}
+    phase = "index"
+    resume_pages = 0
+    if checkpoint is not None:
+        phase = checkpoint["phase"]
+        resume_pages = checkpoint["pages"]
+        curr_doc_count = first_doc_num + resume_pages
+        curr_file_num = checkpoint["runs"]["file_num"]
+        spilled_runs = [os.path.join(intermediates_path, name) for name in checkpoint["runs"]["files"]]
+        stats = checkpoint["stats"]
+        total_num_tokens = stats["tokens"]
+        analysis_stats.update(stats["analysis"])
+        if phase == "merged":
+            num_index_tokens = stats["index_tokens"]
+            num_index_files = stats["index_files"]
+            text_index_size = stats["text_index_size"]
+            index_file_size = stats["index_file_size"]
+        log.info("Resuming from the checkpoint: %s phase, %d pages indexed, %d runs", phase, resume_pages,
+                 len(spilled_runs))
+        clean_intermediates(intermediates_path, checkpoint["runs"]["files"])
+    else:
+        clean_intermediates(intermediates_path)
+    st = time.time()
+    if phase == "index":
+        with open_dump(wiki_dump_in_path, args.reader, args.reader_workers, args.dump_index) as wiki_xml_dump:
+            st = time.time()
+            main(wiki_xml_dump, args.workers, args.batch_size, resume_pages)
 
     end1 = time.time()
-    print("Primary Indexing Done. Time taken: ", end1 - st)
-    print('Creating Secondary Index...')
-    split_final_index()
+    log.info("Primary indexing done in %.2f s", end1 - st)
+    if phase != "merged":
+        log.info("Merging into the final and secondary index...")
+        mergeFiles(args.merge_fan_in, args.merge_buffer_kb * 1024, args.shards)
+        # Workers of an interrupted build may have spilled batches after it was killed.
+        clean_intermediates(intermediates_path)
     end2 = time.time()
-    print("Secondary Indexing done. Total time taken: ", end2 - st)
+    log.info("Secondary indexing done. Total time %.2f s", end2 - st)
+    if args.impacts:
+        with metrics.timer("index.impacts"):
+            writeImpactIndex(inv_index_out_path, curr_doc_count, args.impact_bits, args.merge_buffer_kb * 1024)
+        log.info("Impact index written in %.2f s", time.time() - end2)
+    # A resumed build may have split the titles already.
+    if args.shards > 1 and os.path.exists(inv_index_out_path + '/titles.bin'):
+        bases = shard_bases(curr_doc_count, args.shards)
+        split_titles(inv_index_out_path + '/titles.bin', make_shards(inv_index_out_path, args.shards), bases)
+        os.remove(inv_index_out_path + '/titles.bin')
+    if args.shards > 1:
+        publish_shards(inv_index_out_path, curr_doc_count, args.shards)
     writeIndexStatFile()
+    if args.segment:
+        add_segment(index_root, segment_name, first_doc_num, curr_doc_count - first_doc_num, delete_ids)
+    else:
+        write_build_id(inv_index_out_path)
+    remove_checkpoint(index_root)
+    metrics.inc("index.tokens", total_num_tokens)
+    if args.metrics:
+        metrics.write(args.metrics, args.metrics_format)
@@ -0,0 +1,134 @@
+import re
+import bisect
+import struct
+from array import array
+from postings import encode_varint, read_varint, num_fields, mask_fields
+
+# Lexicon of an index directory (lexicon.bin): every indexed term in sorted order with its df in
+# each field, front coded, so search can keep it in memory and expand prefix and wildcard
+# patterns ("photo*", "col?r") without reading the dictionary. Terms are stored in blocks of
+# block_size; the first term of a block is stored whole, the others as the length of the prefix
+# they share with the previous term and the rest of the term:
+#     per term: shared length varint, suffix length varint, suffix, field mask byte, df varint
+#               of every field in the mask
+#     <blocks><block offsets: uint64 * num_blocks><footer: num_terms uint64, num_blocks uint64, magic>
+# The first term of every block is decoded at load time; a pattern's literal prefix is found by
+# bisecting them, and only the blocks from there on are decoded.
+
+footer = struct.Struct('<QQ4s')
+magic = b'WLX1'
+block_size = 16
+wildcards = "*?"
+
+
+class LexiconWriter(object):
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.offsets = array('Q')
+        self.offset = 0
+        self.num_terms = 0
+        self.prev = b""
+
+    # Terms must be added in sorted order; dfs: the df of every field.
+    def add(self, term, dfs):
+        encoded = term.encode('utf-8')
+        out = bytearray()
+        if self.num_terms % block_size == 0:
+            self.offsets.append(self.offset)
+            shared = 0
+        else:
+            shared = 0
+            limit = min(len(encoded), len(self.prev))
+            while shared < limit and encoded[shared] == self.prev[shared]:
+                shared += 1
+        encode_varint(shared, out)
+        encode_varint(len(encoded) - shared, out)
+        out += encoded[shared:]
+        mask = 0
+        for i in range(num_fields):
+            if dfs[i] > 0:
+                mask |= 1 << i
+        out.append(mask)
+        for i in mask_fields[mask]:
+            encode_varint(dfs[i], out)
+        self.f.write(out)
+        self.offset += len(out)
+        self.num_terms += 1
+        self.prev = encoded
+
+    def close(self):
+        self.f.write(self.offsets.tobytes())
+        self.f.write(footer.pack(self.num_terms, len(self.offsets), magic))
+        self.f.close()
+
+
+class Lexicon(object):
+    def __init__(self, data):
+        self.data = data
+        self.num_terms, num_blocks, file_magic = footer.unpack(data[-footer.size:])
+        if file_magic != magic:
+            raise ValueError("not a lexicon")
+        offsets_pos = len(data) - footer.size - 8 * num_blocks
+        self.offsets = array('Q', data[offsets_pos: offsets_pos + 8 * num_blocks])
+        self.blocks_end = offsets_pos
+        self.first_terms = [self.decode_term(offset)[0] for offset in self.offsets]
+
+    def decode_term(self, pos, prev=b""):
+        data = self.data
+        shared, pos = read_varint(data, pos)
+        length, pos = read_varint(data, pos)
+        term = prev[:shared] + data[pos: pos + length]
+        pos += length
+        mask = data[pos]
+        pos += 1
+        dfs = [0] * num_fields
+        for i in mask_fields[mask]:
+            dfs[i], pos = read_varint(data, pos)
+        return term, dfs, pos
+
+    # Sorted (term, dfs) of the terms starting with prefix.
+    def prefix_terms(self, prefix):
+        encoded = prefix.encode('utf-8')
+        block = max(bisect.bisect_right(self.first_terms, encoded) - 1, 0)
+        pos = self.offsets[block] if self.offsets else self.blocks_end
+        term = b""
+        while pos < self.blocks_end:
+            term, dfs, pos = self.decode_term(pos, term)
+            if term.startswith(encoded):
+                yield term.decode('utf-8'), dfs
+            elif term > encoded:
+                return
+
+    # (term, dfs) of the terms matching a pattern in which * stands for any characters and ?
+    # for one character.
+    def expand(self, pattern):
+        prefix = literal_prefix(pattern)
+        matcher = pattern_regex(pattern)
+        for term, dfs in self.prefix_terms(prefix):
+            if matcher.fullmatch(term):
+                yield term, dfs
+
+    def size(self):
+        return len(self.data)
+
+
+def is_pattern(term):
+    return any(c in term for c in wildcards)
+
+
+# Part of a pattern before its first wildcard.
+def literal_prefix(pattern):
+    return re.split(r"[*?]", pattern, 1)[0]
+
+
+def pattern_regex(pattern):
+    return re.compile("".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in pattern))
+
+
+# The lexicon of path, None if the index has none.
+def read_lexicon(path):
+    try:
+        with open(path, 'rb') as f:
+            return Lexicon(f.read())
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,121 @@
+import json
+import time
+import threading
+from atomic import write_atomic
+
+# Process wide counters, timers and gauges for the indexer and the searcher. Names are dotted,
+# stage first ("index.spill", "search.decode"). A timer accumulates a call count and seconds.
+# Worker processes send the difference of their snapshots back to the parent (delta/merge).
+# Snapshots are exported as JSON or in the Prometheus text format, at the end of a run or
+# periodically by a reporter thread.
+
+
+class Timer(object):
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start)
+
+
+class Metrics(object):
+    def __init__(self):
+        self.counters = {}
+        self.timers = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds, count=1):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [count, seconds]
+            else:
+                timer[0] += count
+                timer[1] += seconds
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def snapshot(self):
+        with self.lock:
+            return {"counters": dict(self.counters),
+                    "timers": {name: {"count": count, "seconds": round(seconds, 6)}
+                               for name, (count, seconds) in self.timers.items()},
+                    "gauges": dict(self.gauges)}
+
+    # Counters and timers added since an earlier snapshot.
+    def delta(self, before):
+        now = self.snapshot()
+        counters = {name: value - before["counters"].get(name, 0) for name, value in now["counters"].items()}
+        timers = {}
+        for name, timer in now["timers"].items():
+            old = before["timers"].get(name, {"count": 0, "seconds": 0.0})
+            timers[name] = {"count": timer["count"] - old["count"], "seconds": timer["seconds"] - old["seconds"]}
+        return {"counters": counters, "timers": timers, "gauges": {}}
+
+    def merge(self, snapshot):
+        for name, value in snapshot["counters"].items():
+            self.inc(name, value)
+        for name, timer in snapshot["timers"].items():
+            self.add_time(name, timer["seconds"], timer["count"])
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+            self.gauges.clear()
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=1, sort_keys=True)
+
+    def to_prometheus(self, prefix="wiki_"):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = prefix + name.replace('.', '_') + "_total"
+            lines.append("# TYPE " + metric + " counter")
+            lines.append(metric + " " + str(value))
+        for name, timer in sorted(snapshot["timers"].items()):
+            metric = prefix + name.replace('.', '_') + "_seconds"
+            lines.append("# TYPE " + metric + " summary")
+            lines.append(metric + "_count " + str(timer["count"]))
+            lines.append(metric + "_sum " + str(timer["seconds"]))
+        for name, value in sorted(snapshot["gauges"].items()):
+            metric = prefix + name.replace('.', '_')
+            lines.append("# TYPE " + metric + " gauge")
+            lines.append(metric + " " + str(value))
+        return "\n".join(lines) + "\n"
+
+    # Writes a snapshot to path, atomically: Prometheus text for "prometheus", JSON otherwise.
+    def write(self, path, format="json"):
+        write_atomic(path, self.to_prometheus() if format == "prometheus" else self.to_json())
+
+    # Writes a snapshot every interval seconds from a daemon thread. before_write, if given,
+    # is called first to refresh gauges.
+    def start_reporter(self, path, format, interval, before_write=None):
+        def report():
+            while True:
+                time.sleep(interval)
+                if before_write is not None:
+                    before_write()
+                self.write(path, format)
+        reporter = threading.Thread(target=report, daemon=True)
+        reporter.start()
+        return reporter
+
+
+metrics = Metrics()
@@ -0,0 +1,323 @@
+import struct
+from array import array
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Binary posting list format shared by index.py and search.py.
+#
+# Every index file is a sequence of records:
+#     <key length: uint16><payload length: uint32><key bytes><payload bytes>
+# where the key is a term and the payload is a run of variable-byte integers holding the
+# postings of all fields of the term:
+#     df, last doc number, byte length of the doc gaps, then df doc number gaps,
+#     df field masks, and the tf of every field set in the masks
+# The first gap is the doc number itself. Bit i of a field mask is set when the term occurs in
+# field field_acronyms[i] of the document; the tfs follow in doc order, and field order within
+# a doc. Storing the last doc number and the length of the gaps lets two lists be concatenated
+# without decoding them.
+
+record_header = struct.Struct('<HI')
+field_acronyms = ['b', 'c', 'i', 'l', 'r', 't']
+num_fields = len(field_acronyms)
+# Field slots set in each field mask.
+mask_fields = [[i for i in range(num_fields) if mask >> i & 1] for mask in range(1 << num_fields)]
+# Weight of a term in each field when scoring; baked into impacts at index time.
+field_weights = {'t': 100, 'i': 50, 'c': 30, 'b': 30, 'l': 10, 'r': 10}
+
+
+def encode_varint(value, out):
+    while value >= 128:
+        out.append((value & 127) | 128)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(buf, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        if byte < 128:
+            return value | (byte << shift), pos
+        value |= (byte & 127) << shift
+        shift += 7
+
+
+def decode_varints(buf):
+    values = []
+    value = 0
+    shift = 0
+    for byte in buf:
+        if byte < 128:
+            values.append(value | (byte << shift))
+            value = 0
+            shift = 0
+        else:
+            value |= (byte & 127) << shift
+            shift += 7
+    return values
+
+
+# doc_nums must be increasing; masks[j] is the field mask of doc_nums[j] and tfs are the
+# tfs of all masked fields.
+def encode_postings(doc_nums, masks, tfs):
+    gaps = bytearray()
+    prev = 0
+    for doc_num in doc_nums:
+        encode_varint(doc_num - prev, gaps)
+        prev = doc_num
+    out = bytearray()
+    encode_varint(len(doc_nums), out)
+    encode_varint(doc_nums[-1], out)
+    encode_varint(len(gaps), out)
+    out += gaps
+    out += bytes(masks)
+    for tf in tfs:
+        encode_varint(tf, out)
+    return bytes(out)
+
+
+# Returns (doc_nums, masks, tfs) as stored.
+def decode_postings(payload):
+    values = decode_varints(payload)
+    df = values[0]
+    doc_nums = array('I')
+    doc_num = 0
+    for gap in values[3: 3 + df]:
+        doc_num += gap
+        doc_nums.append(doc_num)
+    return doc_nums, array('B', values[3 + df: 3 + 2 * df]), array('I', values[3 + 2 * df:])
+
+
+# Returns {field slot: (doc_nums, tfs)} of the given slots, all of them by default.
+def decode_fields(payload, slots=range(num_fields)):
+    doc_nums, masks, tfs = decode_postings(payload)
+    fields = {slot: (array('I'), array('I')) for slot in slots}
+    if len(fields) == 1:
+        # A single field only needs the mask bit and the position of its tfs.
+        slot = next(iter(slots))
+        field_docs, field_tfs = fields[slot]
+        bit = 1 << slot
+        pos = 0
+        for j in range(len(doc_nums)):
+            mask = masks[j]
+            if mask & bit:
+                field_docs.append(doc_nums[j])
+                field_tfs.append(tfs[pos + len(mask_fields[mask & (bit - 1)])])
+            pos += len(mask_fields[mask])
+        return fields
+    pos = 0
+    for j in range(len(doc_nums)):
+        for i in mask_fields[masks[j]]:
+            if i in fields:
+                fields[i][0].append(doc_nums[j])
+                fields[i][1].append(tfs[pos])
+            pos += 1
+    return fields
+
+
+# Varints of payload as a numpy uint64 array, without a Python loop over the bytes.
+def decode_varints_numpy(payload):
+    buf = np.frombuffer(payload, dtype=np.uint8)
+    # Every byte below 128 ends a varint.
+    ends = np.flatnonzero(buf < 128)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # Shift of every byte inside its varint.
+    shifts = np.arange(len(buf)) - np.repeat(starts, ends - starts + 1)
+    parts = (buf & 127).astype(np.uint64) << (7 * shifts).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+# Same as decode_fields, into numpy uint32 arrays. The position of a field's tf is the number
+# of tfs before the doc plus the number of lower fields set in its mask. Requires numpy.
+def decode_fields_numpy(payload, slots=range(num_fields)):
+    values = decode_varints_numpy(payload)
+    df = int(values[0])
+    doc_nums = np.cumsum(values[3: 3 + df]).astype(np.uint32)
+    masks = values[3 + df: 3 + 2 * df].astype(np.int64)
+    tfs = values[3 + 2 * df:].astype(np.uint32)
+    counts = np.array([len(slots) for slots in mask_fields], dtype=np.int64)
+    firsts = np.cumsum(counts[masks]) - counts[masks]
+    fields = {}
+    for i in slots:
+        present = np.flatnonzero(masks & (1 << i))
+        lower = masks[present] & ((1 << i) - 1)
+        fields[i] = (doc_nums[present], tfs[firsts[present] + counts[lower]])
+    return fields
+
+
+# Postings without the documents in drop, re-encoded; None if no document is left.
+def filter_postings(payload, drop):
+    doc_nums, masks, tfs = decode_postings(payload)
+    live_docs = []
+    live_masks = []
+    live_tfs = []
+    pos = 0
+    for j in range(len(doc_nums)):
+        count = len(mask_fields[masks[j]])
+        if doc_nums[j] not in drop:
+            live_docs.append(doc_nums[j])
+            live_masks.append(masks[j])
+            live_tfs.extend(tfs[pos: pos + count])
+        pos += count
+    if len(live_docs) == len(doc_nums):
+        return payload
+    if len(live_docs) == 0:
+        return None
+    return encode_postings(live_docs, live_masks, live_tfs)
+
+
+# Impact ordered posting lists (index.py --impacts). Each posting carries a quantized impact,
+# the integer share of field weight * idf * log2(tf + 1) of the document score, and postings
+# are grouped into blocks of equal impact, highest first:
+#     number of blocks, then per block: impact, number of docs, doc number gaps
+# Doc numbers are increasing inside a block, and the first gap of a block is the doc number.
+def encode_impacts(doc_nums, impacts):
+    blocks = defaultdict(list)
+    for doc_num, impact in zip(doc_nums, impacts):
+        blocks[impact].append(doc_num)
+    out = bytearray()
+    encode_varint(len(blocks), out)
+    for impact in sorted(blocks, reverse=True):
+        block = blocks[impact]
+        encode_varint(impact, out)
+        encode_varint(len(block), out)
+        prev = 0
+        for doc_num in block:
+            encode_varint(doc_num - prev, out)
+            prev = doc_num
+    return bytes(out)
+
+
+# Returns [(impact, doc_nums)] from the highest impact down.
+def decode_impacts(payload):
+    values = decode_varints(payload)
+    blocks = []
+    pos = 1
+    for _ in range(values[0]):
+        impact = values[pos]
+        count = values[pos + 1]
+        pos += 2
+        doc_nums = array('I')
+        doc_num = 0
+        for gap in values[pos: pos + count]:
+            doc_num += gap
+            doc_nums.append(doc_num)
+        pos += count
+        blocks.append((impact, doc_nums))
+    return blocks
+
+
+# The impact record of a term holds the impact lists of its fields: the field mask, then the
+# list of every field in the mask, in field order, each preceded by its length in bytes.
+# field_impacts: (doc_nums, impacts) of every field slot, empty for fields without the term.
+def encode_field_impacts(field_impacts):
+    mask = 0
+    sections = bytearray()
+    for i in range(num_fields):
+        doc_nums, impacts = field_impacts[i]
+        if len(doc_nums) > 0:
+            mask |= 1 << i
+            section = encode_impacts(doc_nums, impacts)
+            encode_varint(len(section), sections)
+            sections += section
+    out = bytearray()
+    encode_varint(mask, out)
+    return bytes(out + sections)
+
+
+# Returns {field slot: [(impact, doc_nums)]} for the given slots; only those are decoded.
+def decode_field_impacts(payload, slots):
+    mask, pos = read_varint(payload, 0)
+    field_blocks = {slot: [] for slot in slots}
+    for i in mask_fields[mask]:
+        length, pos = read_varint(payload, pos)
+        if i in field_blocks:
+            field_blocks[i] = decode_impacts(payload[pos: pos + length])
+        pos += length
+    return field_blocks
+
+
+# Splits postings at the doc numbers in bounds (increasing, the first one 0): returns the
+# postings of every range [bounds[i], bounds[i + 1]), None for ranges without documents.
+def split_postings(payload, bounds):
+    doc_nums, masks, tfs = decode_postings(payload)
+    parts = []
+    j = 0
+    pos = 0
+    for i in range(len(bounds)):
+        end = bounds[i + 1] if i + 1 < len(bounds) else float('inf')
+        first = j
+        first_pos = pos
+        while j < len(doc_nums) and doc_nums[j] < end:
+            pos += len(mask_fields[masks[j]])
+            j += 1
+        if j == first:
+            parts.append(None)
+        elif first == 0 and j == len(doc_nums):
+            parts.append(payload)
+        else:
+            parts.append(encode_postings(doc_nums[first: j], masks[first: j], tfs[first_pos: pos]))
+    return parts
+
+
+# Concatenate posting lists given in doc number order. Only the first gap of each list is
+# re-encoded; the rest of the gaps, the masks and the tfs are copied as they are.
+def concat_postings(payloads):
+    if len(payloads) == 1:
+        return payloads[0]
+    total_df = 0
+    last_doc = 0
+    gaps = bytearray()
+    masks = bytearray()
+    tfs = bytearray()
+    for payload in payloads:
+        df, pos = read_varint(payload, 0)
+        last, pos = read_varint(payload, pos)
+        gaps_len, pos = read_varint(payload, pos)
+        first, first_end = read_varint(payload, pos)
+        encode_varint(first - last_doc, gaps)
+        gaps += payload[first_end: pos + gaps_len]
+        masks += payload[pos + gaps_len: pos + gaps_len + df]
+        tfs += payload[pos + gaps_len + df:]
+        total_df += df
+        last_doc = last
+    out = bytearray()
+    encode_varint(total_df, out)
+    encode_varint(last_doc, out)
+    encode_varint(len(gaps), out)
+    return bytes(out + gaps + masks + tfs)
+
+
+# Returns the number of bytes written.
+def write_record(f, key, payload):
+    key = key.encode('utf-8')
+    f.write(record_header.pack(len(key), len(payload)))
+    f.write(key)
+    f.write(payload)
+    return record_header.size + len(key) + len(payload)
+
+
+# Returns (key, payload), or None at the end of the file.
+def read_record(f):
+    header = f.read(record_header.size)
+    if len(header) < record_header.size:
+        return None
+    key_len, payload_len = record_header.unpack(header)
+    key = f.read(key_len).decode('utf-8')
+    return key, f.read(payload_len)
+
+
+# Size a field's postings would take in the old text format: term-field:d1-1|d5-1\n
+def text_size(key, doc_nums, tfs):
+    size = len(key.encode('utf-8')) + 1 + len(doc_nums)
+    for doc_num, tf in zip(doc_nums, tfs):
+        size += len(str(doc_num)) + len(str(tf)) + 2
+    return size
@@ -3,88 +3,832 @@ import sys
 import time
 import math
 import re
-from typing import DefaultDict
-import Stemmer
+import argparse
+import logging
+import threading
+import multiprocessing
+import traceback
 import bisect
-from tokenize import *
+import mmap
+import heapq
 from collections import defaultdict
+import analysis
+from titles import TitleStore
+from array import array
+from cache import LRUCache, ResultCache
+from metrics import metrics
+from bloom import read_filter
+from lexicon import read_lexicon, is_pattern, literal_prefix, wildcards
+from segments import ManifestLock, is_segmented, read_manifest, read_tombstones, segment_path
+from shards import is_sharded, shard_path, read_manifest as read_shard_manifest
+from postings import np, decode_fields, decode_fields_numpy, decode_field_impacts, field_weights, field_acronyms
+from postings import num_fields
 
-field_acronyms = ['b', 'c', 'i', 'l', 'r', 't']
-punctuation = ".,|+-@~`:;?()*\"'=\\&/<>[]{}#!%^$ "
+log = logging.getLogger("search")
 total_num_docs = 0
 out_file = None
 
-stemmer = Stemmer.Stemmer('english')
-check_stopword = defaultdict(int)
+index_dir = "."
+build_id = ""
+# Segments of the loaded index in doc number order; a plain index is one segment.
+index_segments = []
+segment_bases = []
+# "maxscore", "numpy", "exhaustive" or "impact".
+ranking = "maxscore"
+# Scores are ranked after rounding to this many digits, so both rankings agree on ties.
+score_digits = 6
+# Postings fetched up front for a batch of queries, keyed by "term-field".
+batch_postings = {}
+# Postings scored and skipped by the last query of the thread.
+query_stats = threading.local()
+# Decoded posting lists shared by all queries, keyed by "term-field".
+posting_cache = LRUCache(64 * 1024 * 1024)
+# Final results of queries, keyed by result_key and emptied when the build id changes.
+result_cache = ResultCache(0)
+# Query a sharded index on one worker process per shard (ShardWorkers) rather than in this process.
+use_shard_workers = True
+shard_workers = None
+# A prefix or wildcard query term ("photo*", "t:col?r") is replaced by at most this many of
+# the matching terms, those with the highest document frequencies; its literal prefix must
+# have at least min_pattern_prefix characters.
+max_expansions = 50
+min_pattern_prefix = 2
+# madvise hint for the memory mapped posting files: "random" turns off readahead, which only
+# helps sequential reads; None leaves the kernel default.
+mmap_advice = "random"
+# Number of terms, those with the highest document frequencies, whose posting lists are paged
+# in when an index is loaded.
+prewarm_terms = 0
 
-f = open('secondary_index.txt', 'r')
-secondary_indexes = f.readlines()
-f.close()
 
 def get_total_doc_num():
     global total_num_docs
-    with open('my_stat.txt', 'r') as f:
+    with open(index_dir + '/my_stat.txt', 'r') as f:
         for val in f:
             total_num_docs = int(val.strip("\n"))
-    print(total_num_docs)
+    log.info("%d documents", total_num_docs)
 
-with open('stopwords.txt', 'r') as f:
-    for stopword in f:
-        stopword = stopword.strip(' ').strip("\n")
-        check_stopword[stopword] = 1
 
+def get_build_id(path):
+    try:
+        with open(path + '/build_id.txt', 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
 
-def tokenize(content):
-    return re.findall(
-        "[A-Z]{2,}(?![a-z])|[A-Z][a-z]+(?=[A-Z])|[\'\w\-]+", content)
 
+# Memory maps a file for reading, with the mmap_advice hint. Empty files cannot be mapped.
+def map_file(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mmap_advice is not None and hasattr(mapped, 'madvise'):
+        mapped.madvise(getattr(mmap, 'MADV_' + mmap_advice.upper()))
+    return mapped
 
-def stemWords(content):
-    return stemmer.stemWords(content)
 
+# One index directory: a plain index, or a segment or shard whose doc numbers start at doc_base.
+# Its dictionary and posting files are memory mapped up front, so the segment stays readable
+# after a merge removes its directory. Posting lists are handed to the decoders as memoryview
+# slices of the mapped files, without copying. The dictionary of a shard holds the dfs of the
+# whole index (global_dfs).
+class Segment(object):
+    def __init__(self, path, doc_base=0, tombstones=(), global_dfs=False):
+        self.path = path
+        self.doc_base = doc_base
+        self.global_dfs = global_dfs
+        # Every dictionary_block-th key of dictionary.txt and the byte offset of its line.
+        self.secondary_keys = []
+        self.secondary_offsets = []
+        with open(path + '/secondary_index.txt', 'r') as f:
+            for line in f:
+                key, offset = line.split()
+                self.secondary_keys.append(key)
+                self.secondary_offsets.append(int(offset))
+        self.title_store = TitleStore(path + '/titles.bin')
+        self.num_docs = self.title_store.num_docs
+        self.dictionary = map_file(path + '/dictionary.txt')
+        self.index_maps = {}
+        self.index_views = {}
+        for file_name in os.listdir(path + '/indexes'):
+            file_num = int(file_name[len('index_'):-len('.bin')])
+            self.index_maps[file_num] = map_file(path + '/indexes/' + file_name)
+            self.index_views[file_num] = memoryview(self.index_maps[file_num])
+        # Impact ordered lists, if the index was built with --impacts.
+        self.impact_maps = {}
+        self.impact_views = {}
+        # The dictionary lines of such an index end with the impact offset and length.
+        first_line = self.dictionary[:self.dictionary.find(b"\n")]
+        self.has_impacts = (os.path.exists(path + '/impacts.txt') and
+                            len(first_line.split()) == 4 + 2 * num_fields + 2)
+        if self.has_impacts:
+            for file_name in os.listdir(path + '/impacts'):
+                file_num = int(file_name[len('impact_'):-len('.bin')])
+                self.impact_maps[file_num] = map_file(path + '/impacts/' + file_name)
+                self.impact_views[file_num] = memoryview(self.impact_maps[file_num])
+        # Deleted documents of this segment.
+        self.tombstones = set(doc_num for doc_num in tombstones if doc_base <= doc_num < doc_base + self.num_docs)
+        self.tombstone_array = None
+        if np is not None:
+            self.tombstone_array = np.array(sorted(self.tombstones), dtype=np.uint32)
+        # Bloom filter over the "term-field" keys of the segment, None if it was built without one.
+        self.vocabulary = read_filter(path + '/vocabulary.bloom')
+        # All terms and their dfs, for prefix and wildcard terms; None for indexes built before it.
+        self.lexicon = read_lexicon(path + '/lexicon.bin')
 
-def is_noise(content):
-    global punctuation
-    return content in punctuation or len(content) <= 1 or len(content) >= 30
+    # False if none of the given fields of the term has postings in this segment; True can be
+    # a false positive of the filter.
+    def may_contain(self, term, slots):
+        if self.vocabulary is None:
+            return True
+        with metrics.timer("search.filter"):
+            return self.vocabulary.may_contain(term, slots)
+
+    # Returns (index file, payload offset, payload length, df of every field, max tf of every field
+    # [, impact offset, impact length]) of the term, None if it is not indexed. The secondary
+    # index narrows the search to one block of the dictionary, in which the line of the term
+    # is found by a byte search of the mapped dictionary.
+    def lookup_term(self, term):
+        pos = bisect.bisect_right(self.secondary_keys, term) - 1
+        if pos < 0:
+            return None
+        start = self.secondary_offsets[pos]
+        end = self.secondary_offsets[pos + 1] if pos + 1 < len(self.secondary_offsets) else len(self.dictionary)
+        prefix = term.encode('utf-8') + b" "
+        if self.dictionary[start: start + len(prefix)] == prefix:
+            line_start = start
+        else:
+            line_start = self.dictionary.find(b"\n" + prefix, start, end) + 1
+            if line_start == 0:
+                return None
+        line_end = self.dictionary.find(b"\n", line_start, end)
+        if line_end < 0:
+            line_end = end
+        return tuple(int(val) for val in self.dictionary[line_start + len(prefix): line_end].split())
+
+    # Returns the encoded posting list of a dictionary entry, as a memoryview of the mapped file.
+    def read_posting_list(self, entry):
+        file_num, offset, length = entry[:3]
+        return self.index_views[file_num][offset: offset + length]
+
+    # Decoded {field slot: (doc_nums, tfs)} of the given slots of a dictionary entry, without
+    # deleted documents.
+    def decode_fields(self, entry, slots):
+        with metrics.timer("search.read"):
+            payload = self.read_posting_list(entry)
+        metrics.inc("search.bytes_read", len(payload))
+        with metrics.timer("search.decode"):
+            fields = self.decode_payload(payload, slots)
+            return {slot: self.drop_deleted(*fields[slot]) for slot in slots}
+
+    def decode_payload(self, payload, slots):
+        if ranking == "numpy":
+            return decode_fields_numpy(payload, slots)
+        return decode_fields(payload, slots)
+
+    def drop_deleted(self, doc_nums, tfs):
+        if not self.tombstones or len(doc_nums) == 0:
+            return doc_nums, tfs
+        if ranking == "numpy":
+            live = ~np.isin(doc_nums, self.tombstone_array)
+            return doc_nums[live], tfs[live]
+        live = [j for j in range(len(doc_nums)) if doc_nums[j] not in self.tombstones]
+        if len(live) < len(doc_nums):
+            doc_nums = array('I', [doc_nums[j] for j in live])
+            tfs = array('I', [tfs[j] for j in live])
+        return doc_nums, tfs
+
+    # {field slot: [(impact, doc_nums)]} of a dictionary entry for the given slots, from the
+    # highest impact down.
+    def decode_impacts(self, entry, slots):
+        if not self.has_impacts:
+            raise ValueError(self.path + " has no impact lists; build it with index.py --impacts")
+        with metrics.timer("search.read"):
+            payload = self.impact_views[entry[0]][entry[-2]: entry[-2] + entry[-1]]
+        metrics.inc("search.bytes_read", len(payload))
+        with metrics.timer("search.decode"):
+            return decode_field_impacts(payload, slots)
+
+    # Pages in the posting lists of the num_terms terms with the highest document frequencies.
+    # Returns the number of bytes paged in.
+    def prewarm(self, num_terms):
+        entries = []
+        start = 0
+        while start < len(self.dictionary):
+            end = self.dictionary.find(b"\n", start)
+            if end < 0:
+                end = len(self.dictionary)
+            values = self.dictionary[start: end].split()
+            entries.append((sum(int(val) for val in values[4: 4 + num_fields]), int(values[1]), int(values[2]),
+                            int(values[3])))
+            start = end + 1
+        num_bytes = 0
+        for _, file_num, offset, length in heapq.nlargest(num_terms, entries):
+            mapped = self.index_maps[file_num]
+            page_start = offset - offset % mmap.PAGESIZE
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_WILLNEED, page_start, offset + length - page_start)
+            # Touching a byte of every page makes it resident whether or not madvise is there.
+            for page in range(page_start, offset + length, mmap.PAGESIZE):
+                mapped[page]
+            num_bytes += length
+        return num_bytes
+
+    def close(self):
+        for view in list(self.index_views.values()) + list(self.impact_views.values()):
+            view.release()
+        for mapped in [self.dictionary] + list(self.index_maps.values()) + list(self.impact_maps.values()):
+            if isinstance(mapped, mmap.mmap):
+                try:
+                    mapped.close()
+                except BufferError:
+                    # Cached numpy arrays still refer to it; it is unmapped when they are freed.
+                    pass
+
+
+# Load the index in path: a plain index directory, or the live segments of a segmented index.
+def load_index(path):
+    global index_dir, build_id, index_segments, segment_bases, total_num_docs, shard_workers
+    new_workers = None
+    if is_sharded(path):
+        manifest = read_shard_manifest(path)
+        new_segments = [Segment(shard_path(path, shard["name"]), shard["doc_base"], global_dfs=True)
+                        for shard in manifest["shards"]]
+        new_build_id = get_build_id(path)
+        num_docs = manifest["num_docs"]
+        if use_shard_workers:
+            new_workers = ShardWorkers([(segment.path, segment.doc_base) for segment in new_segments], num_docs)
+    elif is_segmented(path):
+        # The manifest lock keeps a merge from removing segments before they are open.
+        with ManifestLock(path):
+            manifest = read_manifest(path)
+            tombstones = read_tombstones(path)
+            new_segments = [Segment(segment_path(path, segment["name"]), segment["doc_base"], tombstones)
+                            for segment in manifest["segments"]]
+            new_build_id = get_build_id(path)
+        num_docs = sum(segment["num_docs"] - segment["purged"] for segment in manifest["segments"]) - len(tombstones)
+    else:
+        new_segments = [Segment(path)]
+        new_build_id = get_build_id(path)
+        num_docs = None
+    if prewarm_terms > 0 and new_workers is None:
+        prewarm(new_segments)
+    old_segments = index_segments
+    old_workers = shard_workers
+    index_dir = path
+    index_segments = new_segments
+    segment_bases = [segment.doc_base for segment in new_segments]
+    shard_workers = new_workers
+    posting_cache.clear()
+    for segment in old_segments:
+        segment.close()
+    if old_workers is not None:
+        old_workers.close()
+    build_id = new_build_id
+    result_cache.set_build_id(build_id)
+    if num_docs is None:
+        get_total_doc_num()
+    else:
+        total_num_docs = num_docs
+
+
+# Pages in the posting lists of the prewarm_terms most frequent terms of every segment, before
+# the segments serve queries.
+def prewarm(segments):
+    start = time.time()
+    num_bytes = sum(segment.prewarm(prewarm_terms) for segment in segments)
+    metrics.inc("search.prewarm_bytes", num_bytes)
+    log.info("Prewarmed %d KB of posting lists of %d terms per segment in %.2f s", num_bytes // 1024,
+             prewarm_terms, time.time() - start)
 
 
-def removeNoise(content):
-    return [word for word in content if check_stopword[word] != 1 and not is_noise(word)]
+# Worker processes of a sharded index, one per shard. A query is sent to every shard, each
+# returns its top k with scores computed from the dfs of the whole index, and the top k of the
+# index is the best k of those lists. The shards of a query are scored in parallel; queries
+# are sent one at a time.
+class ShardWorkers(object):
+    def __init__(self, shards, num_docs):
+        context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()
+        self.connections = []
+        self.processes = []
+        cache_bytes = posting_cache.max_bytes // max(len(shards), 1)
+        for path, doc_base in shards:
+            connection, child_connection = context.Pipe()
+            process = context.Process(target=shard_worker, daemon=True,
+                                      args=(child_connection, path, doc_base, num_docs, cache_bytes,
+                                            posting_cache.frequency, worker_settings()))
+            process.start()
+            child_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        log.info("Started %d shard workers", len(shards))
 
+    # Sends a request to every shard; returns their replies in shard order.
+    def request(self, message):
+        with self.lock:
+            for connection in self.connections:
+                connection.send(message)
+            replies = [connection.recv() for connection in self.connections]
+        for _, _, worker_metrics in replies:
+            metrics.merge(worker_metrics)
+        for status, reply, _ in replies:
+            if status == "error":
+                raise RuntimeError("shard worker failed:\n" + reply)
+        return [reply for _, reply, _ in replies]
 
-# Tokenizing, removing stopwords, stemming.
-def NLProcessing(content):
-    return stemWords(removeNoise(tokenize(str(content))))
+    # Best k of the shards' (doc_num, score) lists, in the order of a single index.
+    def merge(self, shard_results, max_results):
+        return heapq.nlargest(max_results, [result for results in shard_results for result in results],
+                              key=lambda x: (round(x[1], score_digits), -x[0]))
 
+    def score(self, terms, fields, max_results):
+        replies = self.request(("score", ranking, terms, fields, max_results))
+        query_stats.scored = sum(scored for _, scored, _ in replies)
+        query_stats.skipped = sum(skipped for _, _, skipped in replies)
+        return self.merge([results for results, _, _ in replies], max_results)
 
-with open('stopwords.txt', 'r') as f:
-    for stopword in f:
-        stopword = stopword.strip(' ').strip("\n")
-        check_stopword[stopword] = 1
+    # Returns (results, postings scored, postings skipped) of every analyzed query.
+    def score_batch(self, analyzed, max_results):
+        replies = self.request(("batch", ranking, analyzed, max_results))
+        return [(self.merge([reply[i][0] for reply in replies], max_results),
+                 sum(reply[i][1] for reply in replies), sum(reply[i][2] for reply in replies))
+                for i in range(len(analyzed))]
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+
+
+# Settings of this process that shard workers start with.
+def worker_settings():
+    return {"mmap_advice": mmap_advice, "prewarm_terms": prewarm_terms, "max_expansions": max_expansions}
+
+
+# Worker process of ShardWorkers: answers the requests of the coordinator on one shard.
+def shard_worker(connection, path, doc_base, num_docs, cache_bytes, cache_frequency, settings):
+    global ranking, posting_cache, index_dir, index_segments, segment_bases, total_num_docs, batch_postings
+    posting_cache = LRUCache(cache_bytes, cache_frequency)
+    globals().update(settings)
+    index_dir = path
+    index_segments = [Segment(path, doc_base, global_dfs=True)]
+    if prewarm_terms > 0:
+        prewarm(index_segments)
+    segment_bases = [doc_base]
+    total_num_docs = num_docs
+    request = connection.recv()
+    while request is not None:
+        start_metrics = metrics.snapshot()
+        try:
+            if request[1] != ranking:
+                # Cached lists are decoded for the ranking they were read with.
+                ranking = request[1]
+                posting_cache.clear()
+            if request[0] == "score":
+                _, _, terms, fields, max_results = request
+                reply = (score_terms(terms, fields, max_results), query_stats.scored, query_stats.skipped)
+            else:
+                _, _, analyzed, max_results = request
+                batch_postings = get_lists(sorted(set(key for terms, _ in analyzed for key in terms)))
+                reply = [(score_terms(terms, fields, max_results), query_stats.scored, query_stats.skipped)
+                         for terms, fields in analyzed]
+                batch_postings = {}
+            connection.send(("ok", reply, metrics.delta(start_metrics)))
+        except Exception:
+            batch_postings = {}
+            connection.send(("error", traceback.format_exc(), metrics.delta(start_metrics)))
+        request = connection.recv()
+    connection.close()
+
+
+# Size and expected false positive rate of the vocabulary filters of the loaded index, and the
+# lookups they saved.
+def filter_stats():
+    filters = [segment.vocabulary for segment in index_segments if segment.vocabulary is not None]
+    counters = metrics.snapshot()["counters"]
+    return {"filters": len(filters), "keys": sum(f.num_keys for f in filters),
+            "bytes": sum(f.size() for f in filters),
+            "fp_rate": round(max([f.fp_rate() for f in filters], default=0.0), 6),
+            "skips": counters.get("search.filter_skips", 0),
+            "false_positives": counters.get("search.filter_false_positives", 0)}
+
+
+def get_segment(doc_num):
+    return index_segments[bisect.bisect_right(segment_bases, doc_num) - 1]
 
 
 def get_title(doc_num):
-    file = open("titles/titles_" + str(doc_num // 2000) + '.txt')
-    title = file.readlines()[doc_num % 2000].strip('\n')
-    return title
-
-
-def get_posting_list(term):
-    pos = bisect.bisect(secondary_indexes, term + '\n') - 1
-    print("Index File No.: ", pos)
-    if pos > 0:
-        f = open('indexes/index_' + str(pos) + '.txt', 'r')
-        line = f.readline().strip('\n')
-        while line:
-            words = line.split(":")
-            if term in words[0]:
-                return words[1]
-            line = f.readline().strip('\n')
-    return ""
-
-
-def rank(inp_terms, fields, type):
-    global total_num_docs
+    segment = get_segment(doc_num)
+    return segment.title_store.get_title(doc_num - segment.doc_base)
+
+
+def get_doc_id(doc_num):
+    segment = get_segment(doc_num)
+    return segment.title_store.get(doc_num - segment.doc_base)[0]
+
+
+# Decoded (doc_nums, tfs, max_tf, df) of the given field slots of a term, across all segments.
+# df is the number of live documents of the list, or of the whole index for shards.
+def read_postings(term, slots):
+    # The lists of the segments cover increasing doc number ranges, so they concatenate.
+    doc_lists = {slot: [] for slot in slots}
+    tf_lists = {slot: [] for slot in slots}
+    max_tfs = {slot: 0 for slot in slots}
+    dfs = {slot: 0 for slot in slots}
+    for segment in index_segments:
+        if not segment.may_contain(term, slots):
+            metrics.inc("search.filter_skips")
+            continue
+        with metrics.timer("search.lookup"):
+            entry = segment.lookup_term(term)
+        if entry is None or not any(entry[3 + slot] for slot in slots):
+            if segment.vocabulary is not None:
+                metrics.inc("search.filter_false_positives")
+        if entry is not None:
+            fields = segment.decode_fields(entry, slots)
+            for slot in slots:
+                doc_lists[slot].append(fields[slot][0])
+                tf_lists[slot].append(fields[slot][1])
+                max_tfs[slot] = max(max_tfs[slot], entry[3 + num_fields + slot])
+                if segment.global_dfs:
+                    dfs[slot] = entry[3 + slot]
+                else:
+                    dfs[slot] += len(fields[slot][0])
+    postings = {}
+    for slot in slots:
+        if len(doc_lists[slot]) == 1:
+            postings[slot] = (doc_lists[slot][0], tf_lists[slot][0], max_tfs[slot], dfs[slot])
+        elif len(doc_lists[slot]) > 1 and ranking == "numpy":
+            postings[slot] = (np.concatenate(doc_lists[slot]), np.concatenate(tf_lists[slot]), max_tfs[slot],
+                              dfs[slot])
+        else:
+            doc_nums = array('I')
+            tfs = array('I')
+            for j in range(len(doc_lists[slot])):
+                doc_nums.extend(doc_lists[slot][j])
+                tfs.extend(tf_lists[slot][j])
+            postings[slot] = (doc_nums, tfs, max_tfs[slot], dfs[slot])
+    return postings
+
+
+# Terms matching a prefix or wildcard pattern, {term: df of every field}. All shards have the
+# lexicon of the whole index, so one is enough; the dfs of the lexicons of segments are summed.
+# They still count deleted documents, so on a segmented index with tombstones they are only
+# upper bounds of the live dfs (see live_matches).
+def match_pattern(pattern):
+    term_dfs = {}
+    segments = index_segments[:1] if index_segments and index_segments[0].global_dfs else index_segments
+    with metrics.timer("search.expand"):
+        for segment in segments:
+            if segment.lexicon is None:
+                continue
+            for term, dfs in segment.lexicon.expand(pattern):
+                if term in term_dfs:
+                    dfs = [a + b for a, b in zip(term_dfs[term], dfs)]
+                term_dfs[term] = dfs
+    return term_dfs
+
+
+# Expansion of a pattern in each of the given slots: {slot: [(term, df)]}, the matching terms
+# that occur in the field, at most max_expansions, those with the highest df first. Each field
+# is expanded on its own, so a "term-field" key expands the same whichever other fields are
+# requested with it.
+def expand_pattern(pattern, slots):
+    term_dfs = match_pattern(pattern)
+    deleted = any(segment.tombstones for segment in index_segments)
+    expansion = {}
+    for slot in slots:
+        matches = sorted([(term, dfs[slot]) for term, dfs in term_dfs.items() if dfs[slot] > 0],
+                         key=lambda x: (-x[1], x[0]))
+        truncated = len(matches) > max_expansions
+        if deleted:
+            matches = live_matches(matches, slot)
+        if truncated:
+            metrics.inc("search.pattern_truncated")
+        expansion[slot] = matches[:max_expansions]
+        metrics.inc("search.pattern_expansions", len(expansion[slot]))
+    log.debug("%s expands to %s", pattern, expansion)
+    return expansion
+
+
+# Matches [(term, df)] of a pattern in a field, ordered by lexicon df, with the dfs replaced by
+# the number of live documents of the term's postings, so the expansion and its df are those of
+# a full rebuild. Lexicon dfs are upper bounds: once max_expansions terms have a live df that
+# no term left could beat, the rest are not read and dropped.
+def live_matches(matches, slot):
+    live = []
+    for term, df in matches:
+        if len(live) >= max_expansions and heapq.nsmallest(max_expansions, live)[-1] < (-df, term):
+            break
+        live_df = read_postings(term, [slot])[slot][3]
+        if live_df > 0:
+            live.append((-live_df, term))
+    return [(term, -live_df) for live_df, term in sorted(live)]
+
+
+# Terms of an expansion and the slots each of them is needed for.
+def expansion_slots(expansion):
+    term_slots = defaultdict(list)
+    for slot, matches in expansion.items():
+        for term, _ in matches:
+            term_slots[term].append(slot)
+    return term_slots
+
+
+# Union of the postings of several terms, with the tfs of a document summed.
+def merge_postings(doc_lists, tf_lists):
+    if len(doc_lists) == 1:
+        return doc_lists[0], tf_lists[0]
+    if ranking == "numpy":
+        doc_nums, positions = np.unique(np.concatenate(doc_lists), return_inverse=True)
+        tfs = np.bincount(positions, weights=np.concatenate(tf_lists)).astype(np.uint32)
+        return doc_nums.astype(np.uint32), tfs
+    acc = defaultdict(int)
+    for doc_nums, tfs in zip(doc_lists, tf_lists):
+        for j in range(len(doc_nums)):
+            acc[doc_nums[j]] += tfs[j]
+    doc_nums = array('I', sorted(acc))
+    return doc_nums, array('I', [acc[doc_num] for doc_num in doc_nums])
+
+
+# Postings of a pattern, as read_postings: in each field, the union of the postings of its
+# expansion, scored as one term whose df is the sum of their dfs (at most the number of
+# documents) and whose max tf is the sum of their max tfs, an upper bound of the summed tfs.
+def read_pattern_postings(pattern, slots):
+    expansion = expand_pattern(pattern, slots)
+    doc_lists = {slot: [] for slot in slots}
+    tf_lists = {slot: [] for slot in slots}
+    max_tfs = {slot: 0 for slot in slots}
+    for term, term_slots in expansion_slots(expansion).items():
+        for slot, (doc_nums, tfs, max_tf, _) in read_postings(term, term_slots).items():
+            if len(doc_nums) > 0:
+                doc_lists[slot].append(doc_nums)
+                tf_lists[slot].append(tfs)
+                max_tfs[slot] += max_tf
+    postings = {}
+    for slot in slots:
+        df = min(sum(df for _, df in expansion[slot]), total_num_docs)
+        doc_nums, tfs = array('I'), array('I')
+        if doc_lists[slot]:
+            doc_nums, tfs = merge_postings(doc_lists[slot], tf_lists[slot])
+        postings[slot] = (doc_nums, tfs, max_tfs[slot], df)
+    return postings
+
+
+# Impact ordered lists need document frequencies of the whole index, so they are only used
+# on a plain index built with --impacts.
+def has_impacts():
+    return (len(index_segments) == 1 and not is_segmented(index_dir) and not is_sharded(index_dir) and
+            index_segments[0].has_impacts)
+
+
+# has_impacts() of the index at path, before it is loaded.
+def index_has_impacts(path):
+    if is_segmented(path) or is_sharded(path):
+        return False
+    segment = Segment(path)
+    try:
+        return segment.has_impacts
+    finally:
+        segment.close()
+
+
+# Impact blocks [(impact, doc_nums)] of the given field slots of a term.
+def read_impacts(term, slots):
+    segment = index_segments[0]
+    if not segment.may_contain(term, slots):
+        metrics.inc("search.filter_skips")
+        return {slot: [] for slot in slots}
+    with metrics.timer("search.lookup"):
+        entry = segment.lookup_term(term)
+    if entry is None:
+        return {slot: [] for slot in slots}
+    return segment.decode_impacts(entry, slots)
+
+
+# Impact blocks of a pattern: the impacts of a document in the terms of its expansion are
+# summed, and the documents regrouped in blocks of equal impact.
+def read_pattern_impacts(pattern, slots):
+    acc = {slot: defaultdict(int) for slot in slots}
+    for term, term_slots in expansion_slots(expand_pattern(pattern, slots)).items():
+        for slot, blocks in read_impacts(term, term_slots).items():
+            for impact, doc_nums in blocks:
+                for doc_num in doc_nums:
+                    acc[slot][doc_num] += impact
+    field_blocks = {}
+    for slot in slots:
+        by_impact = defaultdict(list)
+        for doc_num, impact in acc[slot].items():
+            by_impact[impact].append(doc_num)
+        field_blocks[slot] = [(impact, array('I', sorted(by_impact[impact])))
+                              for impact in sorted(by_impact, reverse=True)]
+    return field_blocks
+
+
+# Decoded lists of "term-field" keys, {key: (doc_nums, tfs, max_tf, df)}, or {key: impact blocks}
+# with impacts set, through the batch postings and the posting list cache. All fields of a
+# term share one posting list, so a term is looked up and read once however many of its
+# fields are needed.
+def get_lists(keys, impacts=False):
+    lists = {}
+    missing = defaultdict(set)
+    prefix = "impact:" if impacts else ""
+    for key in keys:
+        if key in lists:
+            continue
+        if key in batch_postings:
+            lists[key] = batch_postings[key]
+            continue
+        cached = posting_cache.get(prefix + key)
+        if cached is not None:
+            lists[key] = cached
+            continue
+        term, field = key.rsplit('-', 1)
+        missing[term].add(field_acronyms.index(field))
+    for term, slots in missing.items():
+        if is_pattern(term):
+            term_lists = read_pattern_impacts(term, slots) if impacts else read_pattern_postings(term, slots)
+        else:
+            term_lists = read_impacts(term, slots) if impacts else read_postings(term, slots)
+        for slot, value in term_lists.items():
+            key = term + "-" + field_acronyms[slot]
+            if impacts:
+                size = len(key) + sum(8 + 4 * len(doc_nums) for _, doc_nums in value) + 200
+            else:
+                size = len(key) + 8 * len(value[0]) + 200
+            posting_cache.put(prefix + key, value, size)
+            lists[key] = value
+    return lists
+
+
+# Exhaustive scoring: every posting of every term is scored.
+def score_exhaustive(term_lists, max_results):
+    scores = defaultdict(float)
+    for doc_nums, tfs, factor, upper_bound in term_lists:
+        for j in range(0, len(doc_nums)):
+            scores[doc_nums[j]] += (factor * math.log2(tfs[j] + 1))
+    query_stats.scored = sum(len(t[0]) for t in term_lists)
+    query_stats.skipped = 0
+    results = sorted(scores.items(), key=lambda x: (-round(x[1], score_digits), x[0]))
+    return results[:max_results]
+
+
+# MaxScore, a list at a time: lists are scored from the highest score upper bound down into
+# per document accumulators. After each list the k-th best accumulator is a lower bound of the
+# final k-th score; once the summed bounds of the lists left fall below it, documents not yet
+# seen cannot reach the top k. The lists left are then only probed for the candidates whose
+# accumulator plus those bounds can still reach it: by binary search when there are few of
+# them, by one pass over the list otherwise. Returns the same top k as score_exhaustive.
+# A term with df + 1 > N, like a wildcard matching N postings, has a negative idf; its list can
+# lower an accumulator after the threshold is taken, so such queries are scored exhaustively.
+def score_maxscore(term_lists, max_results):
+    if max_results <= 0:
+        query_stats.scored = 0
+        query_stats.skipped = sum(len(t[0]) for t in term_lists)
+        return []
+    if any(t[2] < 0 for t in term_lists):
+        return score_exhaustive(term_lists, max_results)
+    term_lists = sorted(term_lists, key=lambda x: -x[3])
+    num_lists = len(term_lists)
+    # rest_bounds[i]: upper bound of the summed contribution of lists i.. .
+    rest_bounds = [0.0] * (num_lists + 1)
+    for i in range(num_lists - 1, -1, -1):
+        rest_bounds[i] = rest_bounds[i + 1] + max(term_lists[i][3], 0.0)
+    # Scores are compared after rounding, so leave a margin for floating point noise.
+    margin = 2 * 10 ** -score_digits
+    scores = defaultdict(float)
+    scored = 0
+    i = 0
+    while i < num_lists:
+        doc_nums, tfs, factor, _ = term_lists[i]
+        for j in range(len(doc_nums)):
+            scores[doc_nums[j]] += factor * math.log2(tfs[j] + 1)
+        scored += len(doc_nums)
+        i += 1
+        if i < num_lists and len(scores) >= max_results:
+            threshold = heapq.nlargest(max_results, scores.values())[-1] - margin
+            if rest_bounds[i] < threshold:
+                break
+    if i < num_lists:
+        candidates = [doc for doc, score in scores.items() if score + rest_bounds[i] >= threshold]
+        candidates.sort()
+        scores = {doc: scores[doc] for doc in candidates}
+        for doc_nums, tfs, factor, _ in term_lists[i:]:
+            if len(candidates) * 8 < len(doc_nums):
+                for doc in candidates:
+                    p = bisect.bisect_left(doc_nums, doc)
+                    if p < len(doc_nums) and doc_nums[p] == doc:
+                        scores[doc] += factor * math.log2(tfs[p] + 1)
+                        scored += 1
+            else:
+                for j in range(len(doc_nums)):
+                    if doc_nums[j] in scores:
+                        scores[doc_nums[j]] += factor * math.log2(tfs[j] + 1)
+                        scored += 1
+    query_stats.scored = scored
+    query_stats.skipped = sum(len(t[0]) for t in term_lists) - scored
+    results = sorted(scores.items(), key=lambda x: (-round(x[1], score_digits), x[0]))
+    return results[:max_results]
+
+
+# Score-at-a-time over impact ordered lists: the blocks of all terms are processed from the
+# highest impact down, adding integer impacts to per document accumulators. remaining is the
+# most a document can still gain: the sum over terms of the impact of their next block.
+# Once a new document cannot reach the k-th score, only existing accumulators are updated.
+# Once no document outside the top k can reach it either, the top k are final; their
+# scores are completed by binary searching the remaining blocks and the rest is skipped.
+# Returns the same top k as summing all quantized impacts.
+def score_impact(term_blocks, max_results):
+    blocks = []
+    for t in range(len(term_blocks)):
+        for j in range(len(term_blocks[t])):
+            blocks.append((term_blocks[t][j][0], t, j))
+    # Stable: the blocks of a term stay in their (decreasing impact) order.
+    blocks.sort(key=lambda x: -x[0])
+    next_impact = [term[0][0] if term else 0 for term in term_blocks]
+    remaining = sum(next_impact)
+    total = sum(len(doc_nums) for term in term_blocks for _, doc_nums in term)
+    acc = {}
+    # k-th best score at the last check; accumulators only grow, so it stays a lower bound.
+    kth = 0
+    adding = True
+    scored = 0
+    next_check = 0
+    done = len(blocks)
+    for i in range(len(blocks)):
+        impact, t, j = blocks[i]
+        doc_nums = term_blocks[t][j][1]
+        if adding:
+            acc_get = acc.get
+            for doc in doc_nums:
+                acc[doc] = acc_get(doc, 0) + impact
+        else:
+            for doc in doc_nums:
+                if doc in acc:
+                    acc[doc] += impact
+        scored += len(doc_nums)
+        new_impact = term_blocks[t][j + 1][0] if j + 1 < len(term_blocks[t]) else 0
+        remaining += new_impact - next_impact[t]
+        next_impact[t] = new_impact
+        if remaining < kth:
+            adding = False
+        # Checks cost a pass over the accumulators, so they are spaced out by postings.
+        if scored < next_check or len(acc) <= max_results:
+            continue
+        next_check = scored + len(acc) // 4
+        top = heapq.nlargest(max_results + 1, acc.values())
+        kth = top[max_results - 1]
+        if remaining < kth:
+            adding = False
+            if top[max_results] + remaining < kth:
+                done = i + 1
+                break
+    if done < len(blocks):
+        top_docs = [doc for doc, _ in heapq.nlargest(max_results, acc.items(), key=lambda x: x[1])]
+        for impact, t, j in blocks[done:]:
+            doc_nums = term_blocks[t][j][1]
+            for doc in top_docs:
+                p = bisect.bisect_left(doc_nums, doc)
+                if p < len(doc_nums) and doc_nums[p] == doc:
+                    acc[doc] += impact
+        acc = {doc: acc[doc] for doc in top_docs}
+    query_stats.scored = scored
+    query_stats.skipped = total - scored
+    return heapq.nlargest(max_results, acc.items(), key=lambda x: (x[1], -x[0]))
+
+
+# Vectorized scoring: the postings of all terms are scored as arrays, summed per document after
+# sorting the doc numbers (np.unique), and the top k are picked with argpartition.
+# Returns the same top k as score_exhaustive. Requires numpy.
+def score_numpy(term_lists, max_results):
+    query_stats.scored = sum(len(t[0]) for t in term_lists)
+    query_stats.skipped = 0
+    if len(term_lists) == 0:
+        return []
+    all_docs = np.concatenate([t[0] for t in term_lists])
+    all_scores = np.concatenate([t[2] * np.log2(t[1] + 1.0) for t in term_lists])
+    docs, positions = np.unique(all_docs, return_inverse=True)
+    scores = np.round(np.bincount(positions, weights=all_scores), score_digits)
+    if len(docs) > max_results:
+        # Keep every document tied with the k-th score, then break ties by doc number.
+        kth_score = scores[np.argpartition(-scores, max_results - 1)[max_results - 1]]
+        candidates = np.flatnonzero(scores >= kth_score)
+        docs = docs[candidates]
+        scores = scores[candidates]
+    order = np.lexsort((docs, -scores))[:max_results]
+    return [(int(docs[i]), float(scores[i])) for i in order]
+
+
+# Returns the "term-field" keys of the query terms and their fields.
+def query_terms(inp_terms, fields, type):
     terms = []
     if type == "field":
         terms = inp_terms
@@ -95,101 +839,328 @@ def rank(inp_terms, fields, type):
             for fld in field_acronyms:
                 terms.append(inp_term + "-" + fld)
                 fields.append(fld)
-    
-    scores = defaultdict(float)
-    num_terms = len(terms)
-    term_occurences = defaultdict(int)
+    return terms, fields
+
 
+# Returns the top k (doc_num, title) pairs for "term-field" keys.
+def rank_terms(terms, fields, max_results=10):
+    return rank_results(score_terms(terms, fields, max_results))
+
+
+# Returns the top k (doc_num, score) pairs for "term-field" keys, from the shard workers if
+# the index is sharded.
+def score_terms(terms, fields, max_results=10):
+    if max_results <= 0:
+        query_stats.scored = 0
+        query_stats.skipped = 0
+        return []
+    if shard_workers is not None:
+        return shard_workers.score(terms, fields, max_results)
+    if ranking == "impact":
+        term_blocks = get_lists(terms, True)
+        with metrics.timer("search.score"):
+            return score_impact([term_blocks[term] for term in terms], max_results)
+    # (doc_nums, tfs, field weight * idf, upper bound of the term's score) of every term.
+    term_lists = []
+    postings = get_lists(terms)
     for i in range(0, len(terms)):
-        print("\n----------")
-        postlist = get_posting_list(terms[i])
-        print("postlist: ", postlist)
-        if len(postlist) > 0:
-            tfs = []
-            doc_nums = []
-            docs = postlist.split("d")[1:]
-            for doc in docs:
-                val = doc.split("-")
-                doc_nums.append(val[0])
-                tfs.append(int(val[1].split("|")[0]))
-            df = len(doc_nums)
+        doc_nums, tfs, max_tf, df = postings[terms[i]]
+        if len(doc_nums) > 0:
             idf = math.log2(total_num_docs/(df + 1))
-            print("df: ", df)
-            print("term: ", terms[i])
-            print("docs: ", doc_nums)
-            print("tfs: ", tfs)
-            for j in range(0, len(doc_nums)):
-                doc_num = int(doc_nums[j])
-                tf = tfs[j]
-                weight = 0
-                if fields[i] == 't':
-                    weight = 100
-                elif fields[i] == 'i':
-                    weight = 50
-                elif fields[i] == 'c':
-                    weight = 30
-                elif fields[i] == 'b':
-                    weight = 30
-                elif fields[i] == 'l':
-                    weight = 10
-                elif fields[i] == 'r':
-                    weight = 10
-                scores[doc_num] += (weight * math.log2(tf + 1) * idf)
-                term_occurences[doc_num] += 1
-    results = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+            log.debug("term: %s df: %d\ndocs: %s\ntfs: %s", terms[i], df, doc_nums, tfs)
+            factor = field_weights[fields[i]] * idf
+            term_lists.append((doc_nums, tfs, factor, factor * math.log2(max_tf + 1)))
+
+    with metrics.timer("search.score"):
+        if ranking == "maxscore":
+            return score_maxscore(term_lists, max_results)
+        elif ranking == "numpy":
+            return score_numpy(term_lists, max_results)
+        return score_exhaustive(term_lists, max_results)
+
+
+# Titles of the top k (doc_num, score) pairs.
+def rank_results(results):
+    log.debug("postings scored: %d skipped: %d", query_stats.scored, query_stats.skipped)
+    metrics.inc("search.postings_scored", query_stats.scored)
+    metrics.inc("search.postings_skipped", query_stats.skipped)
+    top_results = []
+    with metrics.timer("search.titles"):
+        for doc_num, score in results:
+            top_results.append((doc_num, get_title(doc_num)))
+    return top_results
+
+
+def format_results(results):
     print_text = ""
-    max_results = 10
-    count = 0
-    i = 0
-    while i < len(results):
-        if term_occurences[results[i][0]] > num_terms / 1000:
-            print_text += (str(results[i][0]) + ', ' + get_title(results[i][0]) + "\n")
-            # print(scores[results[i][0]])
-            count += 1
-            if count >= max_results:
-                break
-        i+=1
+    for doc_num, title in results:
+        print_text += (str(doc_num) + ', ' + title + "\n")
     return print_text
 
 
-def search_field_query(query):
+# Prefix and wildcard terms are kept as typed (case folded, not stemmed) and matched against
+# the lexicon; those with a literal prefix shorter than min_pattern_prefix are dropped.
+# Punctuation around a pattern. A "?" at the end of a word ends a question, so only "*" and a
+# "?" inside a word are wildcards.
+pattern_punctuation = analysis.punctuation.replace("*", "").replace("?", "")
+
+
+def analyze_word(word):
+    pattern = word.strip(pattern_punctuation).rstrip("?").strip(pattern_punctuation)
+    if is_pattern(pattern):
+        if len(literal_prefix(pattern)) >= min_pattern_prefix:
+            return [pattern]
+        return []
+    return analysis.analyze(word)
+
+
+def analyze_field_query(query):
     words = re.findall(r'[b|c|i|l|r|t]:([^:]*)(?!\S)', query)
     temp = re.findall(r'([b|c|i|l|r|t]):', query)
-    tokens = []
+    terms = []
     fields = []
     for i in range(len(words)):
         for word in words[i].split():
-            tks = NLProcessing(word)
-            for tkn in tks:
-                tokens.append(tkn)
+            for term in analyze_word(word):
+                terms.append(term)
                 fields.append(temp[i])
-    terms = NLProcessing(tokens)
-    return rank(terms, fields, 'field')
+    return query_terms(terms, fields, 'field')
 
 
-def search_simple_query(query):
-    terms = NLProcessing(query)
-    return rank(terms, [], 'simple')
+def analyze_simple_query(query):
+    if any(c in query for c in wildcards):
+        terms = [term for word in query.split() for term in analyze_word(word)]
+    else:
+        terms = analysis.analyze(query)
+    return query_terms(terms, [], 'simple')
 
 
-if __name__ == "__main__":
-    get_total_doc_num()
-    query_file_name = sys.argv[1]
-    query_file = open(query_file_name, 'r')
-    queries = query_file.readlines()
-    out_file = open('queries_op.txt', 'w')
+def is_field_query(query):
+    return ("t:" in query or "b:" in query or "i:" in query or "c:" in query or "l:" in query or "r:" in query)
+
+
+# Returns the "term-field" keys of a query and their fields.
+def analyze(query):
+    query = query.lower()
+    if is_field_query(query):
+        return analyze_field_query(str(query))
+    return analyze_simple_query(str(query))
+
+
+# Result cache key of an analyzed query: its "term-field" keys in sorted order (repeated keys
+# count twice in the score, so they are kept), k and the ranking.
+def result_key(terms, max_results):
+    return ranking + " " + str(max_results) + " " + " ".join(sorted(terms))
+
+
+# Top k (doc_num, title) pairs of an analyzed query, from the result cache if it has them.
+def cached_rank_terms(terms, fields, max_results=10):
+    key = result_key(terms, max_results)
+    results = result_cache.get(key)
+    if results is not None:
+        query_stats.scored = 0
+        query_stats.skipped = 0
+        return results
+    results = rank_terms(terms, fields, max_results)
+    result_cache.put(key, results)
+    return results
+
+
+# Returns the top k (doc_num, title) pairs of a query.
+def search(query, max_results=10):
+    metrics.inc("search.queries")
+    with metrics.timer("search.query"):
+        return cached_rank_terms(*analyze(query), max_results)
+
+
+# Refreshes the gauges of the metrics snapshot.
+def update_metrics():
+    for key, value in posting_cache.stats().items():
+        metrics.set("search.posting_cache." + key, value)
+    metrics.set("search.num_docs", total_num_docs)
+    for key, value in result_cache.stats().items():
+        metrics.set("search.result_cache." + key, value)
+    stats = filter_stats()
+    metrics.set("search.filter.bytes", stats["bytes"])
+    metrics.set("search.filter.keys", stats["keys"])
+
+
+def score_batch_query(analyzed_query):
+    start = time.time()
+    metrics.inc("search.queries")
+    results = rank_terms(analyzed_query[0], analyzed_query[1])
+    return results, time.time() - start
+
+
+# In a worker process: also returns the metrics the query added.
+def score_batch_query_worker(analyzed_query):
+    start_metrics = metrics.snapshot()
+    results, seconds = score_batch_query(analyzed_query)
+    return results, seconds, metrics.delta(start_metrics)
+
+
+# Batch execution: analyze every query first and answer those in the result cache, fetch each
+# distinct "term-field" posting list of the others once for the whole batch, then score each
+# distinct query once on a pool of forked workers, which share the fetched postings. Returns
+# (results, seconds) per query in query order; the time of a query is its analysis and
+# scoring time plus an equal share of the batch fetch time.
+def run_batch(queries, num_workers):
+    analyzed = []
+    analysis_times = []
     for query in queries:
-        query = query.lower()
         start = time.time()
-        out = ""
-        if ("t:" in query or "b:" in query or "i:" in query or "c:" in query or "l:" in query or "r:" in query):
-            out = search_field_query(str(query))
+        analyzed.append(analyze(query))
+        analysis_times.append(time.time() - start)
+    keys = [result_key(terms, 10) for terms, _ in analyzed]
+    batch = [None] * len(queries)
+    for i in range(len(queries)):
+        results = result_cache.get(keys[i])
+        if results is not None:
+            metrics.inc("search.queries")
+            batch[i] = (results, analysis_times[i])
+    # Repeats of a query in the batch are scored once.
+    first = {}
+    for i in range(len(queries)):
+        if batch[i] is None:
+            first.setdefault(keys[i], i)
+    todo = sorted(first.values())
+    if todo:
+        if shard_workers is not None:
+            outputs = run_shard_batch([analyzed[i] for i in todo], [analysis_times[i] for i in todo])
         else:
-            out = search_simple_query(str(query))
-            query = query + "\n"
-        # out_file.write(query)
-        out_file.write(out)
-        end = time.time()
-        out_file.write(str(round(end - start, 2)) + '\n\n')
+            outputs = run_local_batch([analyzed[i] for i in todo], [analysis_times[i] for i in todo], num_workers)
+        for i, output in zip(todo, outputs):
+            result_cache.put(keys[i], output[0])
+            batch[i] = output
+    for i in range(len(queries)):
+        if batch[i] is None:
+            metrics.inc("search.queries")
+            batch[i] = (batch[first[keys[i]]][0], analysis_times[i])
+    return batch
+
+
+def run_local_batch(analyzed, analysis_times, num_workers):
+    global batch_postings
+    start = time.time()
+    keys = set()
+    for terms, fields in analyzed:
+        keys.update(terms)
+    # Cleared first: get_lists serves keys from the batch postings.
+    batch_postings = {}
+    batch_postings = get_lists(sorted(keys), ranking == "impact")
+    fetch_time = time.time() - start
+    log.info("Batch fetched %d posting lists for %d queries in %.2f s", len(keys), len(analyzed), fetch_time)
+    metrics.add_time("search.batch_fetch", fetch_time)
+
+    if num_workers > 1:
+        pool = multiprocessing.get_context('fork').Pool(num_workers)
+        outputs = []
+        for results, seconds, worker_metrics in pool.map(score_batch_query_worker, analyzed):
+            metrics.merge(worker_metrics)
+            outputs.append((results, seconds))
+        pool.close()
+        pool.join()
+    else:
+        outputs = [score_batch_query(analyzed_query) for analyzed_query in analyzed]
+    batch_postings = {}
+    return [(results, analysis_times[i] + scoring_time + fetch_time / len(analyzed))
+            for i, (results, scoring_time) in enumerate(outputs)]
+
+
+# Batch execution on a sharded index: every shard worker fetches and scores the whole batch.
+# The time of a query is its analysis time plus an equal share of the batch time.
+def run_shard_batch(analyzed, analysis_times):
+    start = time.time()
+    outputs = shard_workers.score_batch(analyzed, 10)
+    batch_time = time.time() - start
+    log.info("Scored %d queries on %d shards in %.2f s", len(analyzed), len(index_segments), batch_time)
+    metrics.add_time("search.batch_fetch", batch_time)
+    batch = []
+    for i, (results, scored, skipped) in enumerate(outputs):
+        metrics.inc("search.queries")
+        query_stats.scored = scored
+        query_stats.skipped = skipped
+        batch.append((rank_results(results), analysis_times[i] + batch_time / len(analyzed)))
+    return batch
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("query_file_name")
+    arg_parser.add_argument("--index-dir", default=".")
+    arg_parser.add_argument("--posting-cache-mb", type=float, default=64,
+                            help="memory budget of the decoded posting list cache")
+    arg_parser.add_argument("--posting-cache-frequency", action="store_true",
+                            help="only cache posting lists requested at least twice")
+    arg_parser.add_argument("--ranking", choices=["maxscore", "numpy", "exhaustive", "impact"], default="maxscore",
+                            help="top k retrieval with MaxScore pruning, vectorized scoring of every posting "
+                                 "(needs numpy), scoring every posting in a loop, or score-at-a-time over "
+                                 "quantized impacts (needs an index built with --impacts)")
+    arg_parser.add_argument("--batch", action="store_true",
+                            help="fetch the postings of all queries together before scoring them")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="scoring processes in batch mode")
+    arg_parser.add_argument("--local-shards", action="store_true",
+                            help="search the shards of a sharded index in this process instead of on a "
+                                 "worker process per shard")
+    arg_parser.add_argument("--madvise", choices=["random", "normal", "sequential", "willneed", "none"],
+                            default=mmap_advice, help="madvise hint for the memory mapped index files")
+    arg_parser.add_argument("--prewarm-terms", type=int, default=0,
+                            help="page in the posting lists of this many of the most frequent terms at startup")
+    arg_parser.add_argument("--result-cache-size", type=int, default=10000,
+                            help="queries whose final results are cached (0 turns the result cache off)")
+    arg_parser.add_argument("--result-cache-ttl", type=float, default=0,
+                            help="seconds a cached result is kept (0: until evicted or the index changes)")
+    arg_parser.add_argument("--result-cache-path", metavar="FILE",
+                            help="load the result cache from FILE at startup and save it there at the end")
+    arg_parser.add_argument("--max-expansions", type=int, default=max_expansions,
+                            help="matching terms a prefix or wildcard term (photo*, col?r) is expanded to")
+    arg_parser.add_argument("--log-level", default="warning", choices=["debug", "info", "warning", "error"],
+                            help="debug also logs the posting lists of every query term")
+    arg_parser.add_argument("--metrics", metavar="FILE", help="write a metrics snapshot to FILE at the end of the run")
+    arg_parser.add_argument("--metrics-format", choices=["json", "prometheus"], default="json")
+    arg_parser.add_argument("--metrics-interval", type=float, default=0,
+                            help="also write the snapshot every METRICS_INTERVAL seconds during the run")
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    ranking = args.ranking
+    if ranking == "numpy" and np is None:
+        sys.exit("--ranking numpy needs numpy installed")
+    posting_cache = LRUCache(int(args.posting_cache_mb * 1024 * 1024), args.posting_cache_frequency)
+    use_shard_workers = not args.local_shards
+    mmap_advice = None if args.madvise == "none" else args.madvise
+    prewarm_terms = args.prewarm_terms
+    max_expansions = args.max_expansions
+    result_cache = ResultCache(args.result_cache_size, args.result_cache_ttl, args.result_cache_path)
+    result_cache.load()
+    load_index(args.index_dir)
+    if ranking == "impact" and not has_impacts():
+        sys.exit("--ranking impact needs a plain index built with index.py --impacts")
+    if args.metrics and args.metrics_interval > 0:
+        metrics.start_reporter(args.metrics, args.metrics_format, args.metrics_interval, update_metrics)
+    query_file = open(args.query_file_name, 'r')
+    queries = query_file.readlines()
+    out_file = open('queries_op.txt', 'w')
+    if args.batch:
+        for results, seconds in run_batch(queries, args.workers):
+            out_file.write(format_results(results))
+            out_file.write(str(round(seconds, 2)) + '\n\n')
+    else:
+        for query in queries:
+            start = time.time()
+            out = format_results(search(query))
+            # out_file.write(query)
+            out_file.write(out)
+            end = time.time()
+            out_file.write(str(round(end - start, 2)) + '\n\n')
     query_file.close()
     out_file.close()
+    if shard_workers is not None:
+        shard_workers.close()
+    log.info("Posting list cache: %s", posting_cache.stats())
+    log.info("Vocabulary filter: %s", filter_stats())
+    log.info("Result cache: %s", result_cache.stats())
+    result_cache.save()
+    if args.metrics:
+        update_metrics()
+        metrics.write(args.metrics, args.metrics_format)
@@ -1 +1 @@
-python3 search.py $1
\ No newline at end of file
+python3 search.py $2 --index-dir $1
\ No newline at end of file
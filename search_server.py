@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+import json
+import argparse
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import search
+from metrics import metrics
+
+# Long running search server. The index is loaded once and queries are answered as JSON:
+#     GET /search?q=<query>&k=<num_results>
+#     GET /status
+#     GET /metrics                  Prometheus text format (?format=json for JSON)
+# The server watches the index for a new build id and reloads it without a restart.
+# index_path is either an index directory, or a directory of index directories in
+# which case the one with the latest build id is served.
+
+
+# Readers/writer lock: queries run concurrently, a reload waits for them and blocks new ones.
+class IndexLock(object):
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writing = False
+
+    def acquire_read(self):
+        with self.cond:
+            while self.writing:
+                self.cond.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.cond:
+            self.readers -= 1
+            if self.readers == 0:
+                self.cond.notify_all()
+
+    def acquire_write(self):
+        with self.cond:
+            while self.writing:
+                self.cond.wait()
+            self.writing = True
+            while self.readers > 0:
+                self.cond.wait()
+
+    def release_write(self):
+        with self.cond:
+            self.writing = False
+            self.cond.notify_all()
+
+
+log = logging.getLogger("search_server")
+index_lock = IndexLock()
+served = (None, None)
+rejected = (None, None)
+
+
+# Returns the directory to serve and its build id. Only complete builds have a build id.
+def latest_index_dir(index_path):
+    build_id = search.get_build_id(index_path)
+    if build_id or os.path.exists(os.path.join(index_path, 'secondary_index.txt')):
+        return index_path, build_id
+    latest = (None, "")
+    for name in os.listdir(index_path):
+        path = os.path.join(index_path, name)
+        if os.path.isdir(path):
+            build_id = search.get_build_id(path)
+            if build_id and build_id > latest[1]:
+                latest = (path, build_id)
+    return latest
+
+
+def reload_index(index_path):
+    global served, rejected
+    path, build_id = latest_index_dir(index_path)
+    if path is None or (path, build_id) in (served, rejected):
+        return False
+    # Checked before loading, so a build that cannot be served leaves the old index in place.
+    if search.ranking == "impact" and not search.index_has_impacts(path):
+        rejected = (path, build_id)
+        raise ValueError(path + " has no impact lists: --ranking impact needs a plain index built with "
+                                "index.py --impacts")
+    index_lock.acquire_write()
+    try:
+        search.load_index(path)
+        served = (path, build_id)
+    finally:
+        index_lock.release_write()
+    metrics.inc("server.reloads")
+    log.info("Serving index %s build %s", path, build_id)
+    return True
+
+
+def watch_index(index_path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            reload_index(index_path)
+        except Exception as e:
+            metrics.inc("server.reload_failures")
+            log.error("Reload failed: %s", e)
+        try:
+            search.result_cache.save()
+        except OSError as e:
+            log.error("Saving the result cache failed: %s", e)
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    def send_json(self, code, body):
+        self.send_text(code, json.dumps(body), 'application/json')
+
+    def send_text(self, code, text, content_type):
+        data = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == '/status':
+            self.send_json(200, {"index_dir": search.index_dir, "build_id": search.build_id,
+                                 "total_num_docs": search.total_num_docs,
+                                 "shard_workers": len(search.shard_workers.processes) if search.shard_workers else 0,
+                                 "posting_cache": search.posting_cache.stats(),
+                                 "result_cache": search.result_cache.stats(),
+                                 "vocabulary_filter": search.filter_stats()})
+        elif url.path == '/metrics':
+            search.update_metrics()
+            if params.get('format', [''])[0] == 'json':
+                self.send_text(200, metrics.to_json(), 'application/json')
+            else:
+                self.send_text(200, metrics.to_prometheus(), 'text/plain; version=0.0.4')
+        elif url.path == '/search':
+            if 'q' not in params:
+                self.send_json(400, {"error": "missing query parameter q"})
+                return
+            query = params['q'][0]
+            try:
+                max_results = int(params.get('k', ['10'])[0])
+            except ValueError:
+                self.send_json(400, {"error": "k must be an integer"})
+                return
+            if max_results < 1:
+                self.send_json(400, {"error": "k must be a positive integer"})
+                return
+            start = time.time()
+            try:
+                index_lock.acquire_read()
+                try:
+                    results = search.search(query, max_results)
+                    results = [{"doc_num": doc_num, "doc_id": search.get_doc_id(doc_num), "title": title}
+                               for doc_num, title in results]
+                    build_id = search.build_id
+                    postings_scored = search.query_stats.scored
+                    postings_skipped = search.query_stats.skipped
+                finally:
+                    index_lock.release_read()
+            except Exception:
+                metrics.inc("server.search_failures")
+                log.exception("Search for %r failed", query)
+                self.send_json(500, {"error": "search failed"})
+                return
+            self.send_json(200, {"query": query, "build_id": build_id,
+                                 "results": results,
+                                 "postings_scored": postings_scored, "postings_skipped": postings_skipped,
+                                 "time_ms": round((time.time() - start) * 1000, 2)})
+        else:
+            self.send_json(404, {"error": "unknown path"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("index_path")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    arg_parser.add_argument("--posting-cache-mb", type=float, default=64,
+                            help="memory budget of the decoded posting list cache")
+    arg_parser.add_argument("--posting-cache-frequency", action="store_true",
+                            help="only cache posting lists requested at least twice")
+    arg_parser.add_argument("--ranking", choices=["maxscore", "numpy", "exhaustive", "impact"], default="maxscore")
+    arg_parser.add_argument("--reload-interval", type=float, default=5,
+                            help="seconds between checks for a new index build")
+    arg_parser.add_argument("--local-shards", action="store_true",
+                            help="search the shards of a sharded index in the server process instead of on a "
+                                 "worker process per shard")
+    arg_parser.add_argument("--madvise", choices=["random", "normal", "sequential", "willneed", "none"],
+                            default=search.mmap_advice, help="madvise hint for the memory mapped index files")
+    arg_parser.add_argument("--prewarm-terms", type=int, default=0,
+                            help="page in the posting lists of this many of the most frequent terms whenever "
+                                 "an index is loaded")
+    arg_parser.add_argument("--result-cache-size", type=int, default=10000,
+                            help="queries whose final results are cached (0 turns the result cache off)")
+    arg_parser.add_argument("--result-cache-ttl", type=float, default=0,
+                            help="seconds a cached result is kept (0: until evicted or the index changes)")
+    arg_parser.add_argument("--result-cache-path", metavar="FILE",
+                            help="load the result cache from FILE at startup and save it there every "
+                                 "reload interval and at shutdown")
+    arg_parser.add_argument("--max-expansions", type=int, default=search.max_expansions,
+                            help="matching terms a prefix or wildcard term (photo*, col?r) is expanded to")
+    arg_parser.add_argument("--log-level", default="info", choices=["debug", "info", "warning", "error"])
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    search.ranking = args.ranking
+    search.use_shard_workers = not args.local_shards
+    search.mmap_advice = None if args.madvise == "none" else args.madvise
+    search.prewarm_terms = args.prewarm_terms
+    search.max_expansions = args.max_expansions
+    search.posting_cache = search.LRUCache(int(args.posting_cache_mb * 1024 * 1024), args.posting_cache_frequency)
+    search.result_cache = search.ResultCache(args.result_cache_size, args.result_cache_ttl, args.result_cache_path)
+    search.result_cache.load()
+    try:
+        if not reload_index(args.index_path):
+            sys.exit("No index found in " + args.index_path)
+    except ValueError as e:
+        sys.exit(str(e))
+    watcher = threading.Thread(target=watch_index, args=(args.index_path, args.reload_interval), daemon=True)
+    watcher.start()
+    server = ThreadingHTTPServer((args.host, args.port), SearchHandler)
+    log.info("Listening on %s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        search.result_cache.save()
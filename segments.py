@@ -0,0 +1,260 @@
+import os
+import sys
+import time
+import json
+import fcntl
+import heapq
+import shutil
+import logging
+import argparse
+from itertools import groupby
+from operator import itemgetter
+from titles import TitleStore, TitleStoreWriter
+from postings import concat_postings, filter_postings, read_record
+from atomic import write_atomic
+from metrics import metrics
+
+# Segmented index: an index directory holding immutable segments, each a complete index
+# (dictionary, posting files, titles) over its own range of doc numbers.
+#
+#     segments.json       manifest: live segments in doc number order (first doc number, number of
+#                         docs, number of deleted docs whose postings were merged away), next doc
+#                         number and segment number
+#     segments/seg_N/     one segment, same layout as a plain index directory
+#     tombstones.txt      doc numbers of deleted or replaced pages, one per line
+#     build_id.txt        changes whenever the set of live segments or tombstones changes
+#
+# New dumps are indexed into a new segment (index.py --segment). Pages of the new segment
+# that already exist in older segments, and pages listed for deletion, get tombstones.
+# Segments are compacted by a tiered merge policy: whenever merge_factor adjacent segments
+# fall in the same size tier they are merged into one, dropping tombstoned postings.
+# Only one indexer may add a segment at a time; merges and additions take the manifest lock.
+
+log = logging.getLogger("segments")
+
+
+def manifest_path(root):
+    return os.path.join(root, 'segments.json')
+
+
+def is_segmented(root):
+    return os.path.exists(manifest_path(root))
+
+
+def segment_path(root, name):
+    return os.path.join(root, 'segments', name)
+
+
+# Written last: a build id marks the index directory as complete, and lets a running
+# search server notice that the index changed.
+def write_build_id(path):
+    write_atomic(os.path.join(path, 'build_id.txt'), time.strftime("%Y%m%d%H%M%S") + "-" + str(os.getpid()) +
+                 "-" + str(time.time_ns() % 1000000))
+
+
+def read_manifest(root):
+    if not is_segmented(root):
+        return {"next_segment": 0, "next_doc_num": 0, "segments": []}
+    with open(manifest_path(root), 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(root, manifest):
+    write_atomic(manifest_path(root), json.dumps(manifest, indent=1))
+
+
+def read_tombstones(root):
+    tombstones = set()
+    path = os.path.join(root, 'tombstones.txt')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                tombstones.add(int(line))
+    return tombstones
+
+
+def write_tombstones(root, tombstones):
+    write_atomic(os.path.join(root, 'tombstones.txt'), "".join(str(doc_num) + "\n" for doc_num in sorted(tombstones)))
+
+
+class ManifestLock(object):
+    def __init__(self, root):
+        self.path = os.path.join(root, 'segments.lock')
+
+    def __enter__(self):
+        self.f = open(self.path, 'w')
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+# Reserve a new segment directory. Returns (name, path, first doc number).
+def new_segment(root):
+    os.makedirs(os.path.join(root, 'segments'), exist_ok=True)
+    with ManifestLock(root):
+        manifest = read_manifest(root)
+        name = 'seg_' + str(manifest["next_segment"])
+        manifest["next_segment"] += 1
+        write_manifest(root, manifest)
+    path = segment_path(root, name)
+    os.makedirs(path)
+    return name, path, manifest["next_doc_num"]
+
+
+# Doc numbers of the live documents whose page id is in page_ids.
+def find_pages(root, segment_list, page_ids, tombstones):
+    doc_nums = []
+    for segment in segment_list:
+        store = TitleStore(os.path.join(segment_path(root, segment["name"]), 'titles.bin'))
+        for i in range(store.num_docs):
+            doc_num = segment["doc_base"] + i
+            if doc_num not in tombstones and store.get(i)[0] in page_ids:
+                doc_nums.append(doc_num)
+    return doc_nums
+
+
+# Publish a finished segment. Older copies of its pages and the pages in delete_ids get tombstones.
+def add_segment(root, name, doc_base, num_docs, delete_ids=()):
+    store = TitleStore(os.path.join(segment_path(root, name), 'titles.bin'))
+    page_ids = set(store.get(i)[0] for i in range(store.num_docs))
+    page_ids.update(delete_ids)
+    with ManifestLock(root):
+        manifest = read_manifest(root)
+        if manifest["next_doc_num"] != doc_base:
+            raise RuntimeError("another segment was added to " + root + " while " + name + " was built")
+        tombstones = read_tombstones(root)
+        replaced = find_pages(root, manifest["segments"], page_ids, tombstones)
+        tombstones.update(replaced)
+        manifest["segments"].append({"name": name, "doc_base": doc_base, "num_docs": num_docs, "purged": 0})
+        manifest["next_doc_num"] = doc_base + num_docs
+        write_tombstones(root, tombstones)
+        write_manifest(root, manifest)
+        write_build_id(root)
+    log.info("Added segment %s with %d documents, %d older documents deleted", name, num_docs, len(replaced))
+
+
+# Size tier of a segment: 0 below min_docs * merge_factor documents, then one tier per factor.
+def segment_tier(num_docs, merge_factor, min_docs):
+    tier = 0
+    size = min_docs * merge_factor
+    while num_docs >= size:
+        size *= merge_factor
+        tier += 1
+    return tier
+
+
+# Index of the first run of merge_factor adjacent segments in the same tier, or None.
+def pick_merge(manifest, merge_factor, min_docs):
+    segment_list = manifest["segments"]
+    tiers = [segment_tier(segment["num_docs"], merge_factor, min_docs) for segment in segment_list]
+    for i in range(len(segment_list) - merge_factor + 1):
+        if len(set(tiers[i: i + merge_factor])) == 1:
+            return i
+    return None
+
+
+# Sorted records of a segment, across its split posting files.
+def segment_records(path):
+    index_path = os.path.join(path, 'indexes')
+    file_names = sorted(os.listdir(index_path), key=lambda name: int(name[len('index_'):-len('.bin')]))
+    for file_name in file_names:
+        with open(os.path.join(index_path, file_name), 'rb', buffering=1 << 20) as f:
+            record = read_record(f)
+            while record:
+                yield record
+                record = read_record(f)
+
+
+# Merged records of adjacent segments, without the postings of tombstoned documents.
+def merged_records(paths, tombstones):
+    merged = heapq.merge(*[segment_records(path) for path in paths], key=itemgetter(0))
+    for key, group in groupby(merged, key=itemgetter(0)):
+        payload = concat_postings([payload for _, payload in group])
+        if tombstones:
+            payload = filter_postings(payload, tombstones)
+            if payload is None:
+                continue
+        yield key, payload
+
+
+def merge_segments(root, first, count, buffer_size=1 << 20):
+    # index.py imports this module, so it is imported here.
+    import index
+    manifest = read_manifest(root)
+    window = manifest["segments"][first: first + count]
+    doc_base = window[0]["doc_base"]
+    num_docs = sum(segment["num_docs"] for segment in window)
+    purged = sum(segment["purged"] for segment in window)
+    tombstones = set(doc_num for doc_num in read_tombstones(root) if doc_base <= doc_num < doc_base + num_docs)
+    name, path, _ = new_segment(root)
+    log.info("Merging segments %s into %s", ", ".join(segment["name"] for segment in window), name)
+    start = time.perf_counter()
+    os.makedirs(os.path.join(path, 'indexes'))
+    paths = [segment_path(root, segment["name"]) for segment in window]
+    index.num_index_tokens = 0
+    index.writeFinalIndex(merged_records(paths, tombstones), path, buffer_size)
+
+    title_store = TitleStoreWriter(os.path.join(path, 'titles.bin'))
+    for segment_dir in paths:
+        store = TitleStore(os.path.join(segment_dir, 'titles.bin'))
+        for i in range(store.num_docs):
+            title_store.add(*store.get(i))
+    title_store.close()
+    total_num_tokens = 0
+    for segment_dir in paths:
+        with open(os.path.join(segment_dir, 'my_stat.txt'), 'r') as f:
+            total_num_tokens += int(f.readline())
+    write_atomic(os.path.join(path, 'my_stat.txt'),
+                 str(total_num_tokens) + "\n" + str(index.num_index_tokens) + "\n" + str(num_docs))
+
+    with ManifestLock(root):
+        manifest = read_manifest(root)
+        names = [segment["name"] for segment in manifest["segments"]]
+        pos = names.index(window[0]["name"])
+        if names[pos: pos + count] != [segment["name"] for segment in window]:
+            raise RuntimeError("segments changed during the merge")
+        manifest["segments"][pos: pos + count] = [{"name": name, "doc_base": doc_base, "num_docs": num_docs,
+                                                  "purged": purged + len(tombstones)}]
+        # Postings of the merged tombstones are gone; tombstones added meanwhile are kept.
+        write_tombstones(root, read_tombstones(root) - tombstones)
+        write_manifest(root, manifest)
+        write_build_id(root)
+    metrics.inc("segments.merges")
+    metrics.add_time("segments.merge", time.perf_counter() - start)
+    # Searchers that still have the old segments open keep reading them until they reload.
+    for segment_dir in paths:
+        shutil.rmtree(segment_dir)
+
+
+# Merge segments until the policy finds nothing to merge. Returns the number of merges.
+def compact(root, merge_factor, min_docs):
+    num_merges = 0
+    first = pick_merge(read_manifest(root), merge_factor, min_docs)
+    while first is not None:
+        merge_segments(root, first, merge_factor)
+        num_merges += 1
+        first = pick_merge(read_manifest(root), merge_factor, min_docs)
+    return num_merges
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("index_root")
+    arg_parser.add_argument("--merge-factor", type=int, default=10,
+                            help="number of same-tier segments merged together")
+    arg_parser.add_argument("--min-segment-docs", type=int, default=10000,
+                            help="segments below min-segment-docs * merge-factor documents are in the lowest tier")
+    arg_parser.add_argument("--watch", type=float, default=0,
+                            help="keep compacting in the background, checking every WATCH seconds")
+    arg_parser.add_argument("--log-level", default="info", choices=["debug", "info", "warning", "error"])
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if not is_segmented(args.index_root):
+        sys.exit(args.index_root + " is not a segmented index")
+    log.info("Merged %d times", compact(args.index_root, args.merge_factor, args.min_segment_docs))
+    while args.watch > 0:
+        time.sleep(args.watch)
+        compact(args.index_root, args.merge_factor, args.min_segment_docs)
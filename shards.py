@@ -0,0 +1,77 @@
+import os
+import json
+from titles import TitleStore, TitleStoreWriter
+from atomic import write_atomic
+
+# Sharded index: an index directory holding document-partitioned shards (index.py --shards N),
+# each a complete index (dictionary, posting files, titles) over its own range of doc numbers.
+#
+#     shards.json         manifest: number of documents of the whole index, and the shards in
+#                         doc number order (name, first doc number, number of docs)
+#     shards/shard_N/     one shard, same layout as a plain index directory
+#
+# The dfs in a shard's dictionary are those of the whole index, so a shard scores a document
+# exactly as the whole index would, and the top k of the index is the best k of the shards'
+# top k lists. search.py queries the shards on one worker process each.
+
+
+def manifest_path(root):
+    return os.path.join(root, 'shards.json')
+
+
+def is_sharded(root):
+    return os.path.exists(manifest_path(root))
+
+
+def shard_path(root, name):
+    return os.path.join(root, 'shards', name)
+
+
+def read_manifest(root):
+    with open(manifest_path(root), 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(root, manifest):
+    write_atomic(manifest_path(root), json.dumps(manifest, indent=1))
+
+
+# First doc number of each of num_shards equal ranges of num_docs documents.
+def shard_bases(num_docs, num_shards):
+    return [num_docs * i // num_shards for i in range(num_shards)]
+
+
+# Creates the shard directories. Returns their paths.
+def make_shards(root, num_shards):
+    paths = []
+    for i in range(num_shards):
+        path = shard_path(root, 'shard_' + str(i))
+        os.makedirs(os.path.join(path, 'indexes'), exist_ok=True)
+        paths.append(path)
+    return paths
+
+
+# Splits the title store of the whole index into the shards' title stores.
+def split_titles(titles_path, paths, bases):
+    store = TitleStore(titles_path)
+    ends = bases[1:] + [store.num_docs]
+    for path, doc_base, end in zip(paths, bases, ends):
+        writer = TitleStoreWriter(os.path.join(path, 'titles.bin'))
+        for doc_num in range(doc_base, end):
+            writer.add(*store.get(doc_num))
+        writer.close()
+
+
+# Removes the manifest, so a rebuild of the index directory is not read as its old shards.
+def unpublish_shards(root):
+    if os.path.exists(manifest_path(root)):
+        os.remove(manifest_path(root))
+
+
+# Writes the manifest of shards built with shard_bases; written last, it marks the shards complete.
+def publish_shards(root, num_docs, num_shards):
+    bases = shard_bases(num_docs, num_shards)
+    ends = bases[1:] + [num_docs]
+    write_manifest(root, {"num_docs": num_docs,
+                          "shards": [{"name": 'shard_' + str(i), "doc_base": bases[i], "num_docs": ends[i] - bases[i]}
+                                     for i in range(num_shards)]})
@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import analysis
+import search
+
+
+class QueryAnalysisTest(unittest.TestCase):
+    # A question mark ending a natural language question is punctuation, not a wildcard.
+    def test_trailing_question_mark(self):
+        self.assertEqual(search.analyze("where is quaartel?"), search.analyze("where is quaartel"))
+        self.assertEqual(search.analyze("t:quaartel?"), search.analyze("t:quaartel"))
+        self.assertEqual(search.analyze("who was gandhi?!"), search.analyze("who was gandhi"))
+
+    # Queries are filtered like documents: no terms with digits, no underscores around terms.
+    def test_index_filtering(self):
+        self.assertEqual(analysis.analyze("covid19 in 1990"), [])
+        self.assertEqual(analysis.analyze("_rock_ x-ray"), ["rock", "x-ray"])
+        terms, _ = search.analyze("rock_ 1990s")
+        self.assertEqual(terms, search.analyze("rock")[0])
+
+    def test_wildcards(self):
+        terms, _ = search.analyze("col?r")
+        self.assertEqual(terms[0], "col?r-b")
+        terms, _ = search.analyze("photo* album?")
+        self.assertIn("photo*-b", terms)
+        self.assertNotIn("album?-b", terms)
+
+    # Every occurrence of an uncached token is a miss, not only its first.
+    def test_cache_misses(self):
+        hits, misses = analysis.analysis_stats["hits"], analysis.analysis_stats["misses"]
+        analysis.analyze("quaxelbrin quaxelbrin quaxelbrin")
+        self.assertEqual(analysis.analysis_stats["misses"] - misses, 3)
+        self.assertEqual(analysis.analysis_stats["hits"] - hits, 0)
+        analysis.analyze("quaxelbrin")
+        self.assertEqual(analysis.analysis_stats["hits"] - hits, 1)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
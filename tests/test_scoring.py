@@ -0,0 +1,27 @@
+import os
+import sys
+import unittest
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import search
+
+
+class ScoringTest(unittest.TestCase):
+    # A negative factor (idf < 0, df + 1 > N) lowers scores after the MaxScore threshold is taken.
+    def test_maxscore_negative_factor(self):
+        term_lists = [(array('i', [1, 2]), array('i', [7, 6]), 10.0, 10.0 * 3.0),
+                      (array('i', [1, 2]), array('i', [15, 1]), -5.0, -5.0)]
+        self.assertEqual(search.score_maxscore(term_lists, 1), search.score_exhaustive(term_lists, 1))
+        self.assertEqual(search.score_maxscore(term_lists, 1)[0][0], 2)
+
+    def test_maxscore_matches_exhaustive(self):
+        term_lists = [(array('i', [1, 3, 5, 8]), array('i', [1, 4, 2, 9]), 2.0, 2.0 * 3.33),
+                      (array('i', [2, 3, 8, 9]), array('i', [5, 1, 1, 2]), 1.5, 1.5 * 2.59),
+                      (array('i', [5, 9]), array('i', [3, 3]), 0.5, 0.5 * 2.0)]
+        for k in range(1, 8):
+            self.assertEqual(search.score_maxscore(term_lists, k), search.score_exhaustive(term_lists, k))
+
+
+if __name__ == '__main__':
+    unittest.main()
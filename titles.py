@@ -0,0 +1,85 @@
+import os
+import mmap
+import struct
+from array import array
+
+# Title store: one binary file holding the "doc_id<TAB>title" entries of all documents,
+# in doc number order, as one concatenated UTF-8 blob followed by the offsets array:
+#     <blob><offsets: uint64 * (num_docs + 1)><footer: num_docs uint64, offsets position uint64, magic>
+# The entry of doc_num is blob[offsets[doc_num]: offsets[doc_num + 1]].
+
+footer = struct.Struct('<QQ4s')
+magic = b'WTS1'
+
+
+# An unfinished store can be synced to disk (sync) and reopened with its first resume_docs
+# titles: the offsets synced so far are appended to <path>.offsets, which outlives close so a
+# build interrupted right after it can still be resumed; the indexer removes it.
+class TitleStoreWriter(object):
+    def __init__(self, path, resume_docs=0):
+        self.path = path
+        self.offsets = array('Q', [0])
+        if not resume_docs:
+            self.f = open(path, 'wb')
+        else:
+            with open(offsets_path(path), 'rb') as f:
+                self.offsets.frombytes(f.read(8 * resume_docs))
+            if len(self.offsets) != resume_docs + 1:
+                raise ValueError(path + " holds fewer than " + str(resume_docs) + " titles")
+            self.f = open(path, 'r+b')
+            self.f.truncate(self.offsets[-1])
+            self.f.seek(self.offsets[-1])
+        self.synced = len(self.offsets) - 1
+        self.offsets_file = None
+
+    # Titles must be added in doc number order.
+    def add(self, doc_id, title):
+        entry = (doc_id.strip() + '\t' + title.strip()).encode('utf-8')
+        self.f.write(entry)
+        self.offsets.append(self.offsets[-1] + len(entry))
+
+    # Makes the titles added so far durable.
+    def sync(self):
+        if self.offsets_file is None:
+            self.offsets_file = open(offsets_path(self.path), 'r+b' if self.synced else 'wb')
+            self.offsets_file.truncate(8 * self.synced)
+            self.offsets_file.seek(8 * self.synced)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.offsets_file.write(self.offsets[self.synced + 1:].tobytes())
+        self.offsets_file.flush()
+        os.fsync(self.offsets_file.fileno())
+        self.synced = len(self.offsets) - 1
+
+    def close(self):
+        offsets_pos = self.offsets[-1]
+        self.f.write(self.offsets.tobytes())
+        self.f.write(footer.pack(len(self.offsets) - 1, offsets_pos, magic))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        if self.offsets_file is not None:
+            self.offsets_file.close()
+
+
+def offsets_path(path):
+    return path + '.offsets'
+
+
+class TitleStore(object):
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.num_docs, offsets_pos, file_magic = footer.unpack(self.mm[-footer.size:])
+        if file_magic != magic:
+            raise ValueError(path + " is not a title store")
+        self.offsets = memoryview(self.mm)[offsets_pos: offsets_pos + 8 * (self.num_docs + 1)].cast('Q')
+
+    # Returns (doc_id, title) of the document.
+    def get(self, doc_num):
+        entry = self.mm[self.offsets[doc_num]: self.offsets[doc_num + 1]].decode('utf-8')
+        doc_id, title = entry.split('\t', 1)
+        return doc_id, title
+
+    def get_title(self, doc_num):
+        return self.get(doc_num)[1]